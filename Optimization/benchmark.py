@@ -0,0 +1,122 @@
+"""
+Rollouts per second of the RK4 and the exactly discretized linear Simulator on random PID gains,
+through evolve, evolve_cost, evolve_batch and evolve_batch_cost, and how far the two integrators'
+costs drift apart.
+
+    python benchmark.py --rollouts 200 --pop-size 100 --output bench.json
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import warnings
+import numpy as np
+from typing import Dict
+
+from optimizer import f, Simulator, F_A, F_B, njit
+
+X0 = [0.0, 0.1]
+
+
+def bench_rollouts(rk4: Simulator, linear: Simulator, gains: np.ndarray, cost_only: bool = False) -> Dict:
+    results = {}
+    for name, sim in [('rk4', rk4), ('linear', linear)]:
+        start_time = time.perf_counter()
+        if cost_only:
+            costs = [sim.evolve_cost(g, X0, 0, 1.0) for g in gains]
+        else:
+            costs = [sim.evolve(g, X0, 0, 1.0)[2] for g in gains]
+        seconds = time.perf_counter() - start_time
+        results[name] = {'seconds': seconds, 'rollouts_per_second': len(gains) / seconds, 'costs': np.array(costs)}
+
+    return results
+
+
+def bench_batch(rk4: Simulator, linear: Simulator, gains: np.ndarray, cost_only: bool = False) -> Dict:
+    results = {}
+    for name, sim in [('rk4', rk4), ('linear', linear)]:
+        start_time = time.perf_counter()
+        if cost_only:
+            costs = sim.evolve_batch_cost(gains, X0, 0, 1.0)
+        else:
+            costs = sim.evolve_batch(gains, X0, 0, 1.0)[2]
+        seconds = time.perf_counter() - start_time
+        results[name] = {'seconds': seconds, 'rollouts_per_second': len(gains) / seconds, 'costs': costs}
+
+    return results
+
+
+def max_relative_error(a: np.ndarray, b: np.ndarray) -> float:
+    # Over the rollouts that stay finite on both paths, unstable gains overflow on both
+    finite = np.isfinite(a) & np.isfinite(b)
+    return float(np.max(np.abs(a[finite] - b[finite]) / np.maximum(1.0, np.abs(a[finite]))))
+
+
+def run(rollouts: int = 200, pop_size: int = 100, nsim: int = 30, dt: float = 0.1, seed: int = 0) -> Dict:
+    rk4 = Simulator(model=f, nx=2, nu=1, nsim=nsim, dt=dt)
+    linear = Simulator(model=(F_A, F_B), nx=2, nu=1, nsim=nsim, dt=dt)
+
+    rng = np.random.default_rng(seed)
+    gains = rng.uniform(-100, 100, [max(rollouts, pop_size), 3])
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        # The first call compiles the kernel when numba is installed
+        linear.evolve(gains[0], X0, 0, 1.0)
+        linear.evolve_cost(gains[0], X0, 0, 1.0)
+
+        serial = bench_rollouts(rk4, linear, gains[:rollouts])
+        cost_only = bench_rollouts(rk4, linear, gains[:rollouts], cost_only=True)
+        batch = bench_batch(rk4, linear, gains[:pop_size])
+        batch_cost_only = bench_batch(rk4, linear, gains[:pop_size], cost_only=True)
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'jit': njit is not None,
+        'steps': int(nsim / dt),
+        'evolve': {
+            'rollouts': rollouts,
+            **{name: {key: value for key, value in result.items() if key != 'costs'} for name, result in serial.items()},
+            'speedup': serial['rk4']['seconds'] / serial['linear']['seconds'],
+            'max_relative_error': max_relative_error(serial['rk4']['costs'], serial['linear']['costs'])
+        },
+        'evolve_cost': {
+            'rollouts': rollouts,
+            **{name: {key: value for key, value in result.items() if key != 'costs'} for name, result in cost_only.items()},
+            'speedup_over_evolve': {name: serial[name]['seconds'] / cost_only[name]['seconds'] for name in cost_only},
+            'max_relative_error': max_relative_error(serial['rk4']['costs'], cost_only['rk4']['costs'])
+        },
+        'evolve_batch': {
+            'pop_size': pop_size,
+            **{name: {key: value for key, value in result.items() if key != 'costs'} for name, result in batch.items()},
+            'speedup': batch['rk4']['seconds'] / batch['linear']['seconds'],
+            'max_relative_error': max_relative_error(batch['rk4']['costs'], batch['linear']['costs'])
+        },
+        'evolve_batch_cost': {
+            'pop_size': pop_size,
+            **{name: {key: value for key, value in result.items() if key != 'costs'} for name, result in batch_cost_only.items()},
+            'speedup_over_evolve_batch': {name: batch[name]['seconds'] / batch_cost_only[name]['seconds'] for name in batch_cost_only},
+            'max_relative_error': max_relative_error(batch['rk4']['costs'], batch_cost_only['rk4']['costs'])
+        }
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RK4 versus exact linear rollout benchmark")
+    parser.add_argument('--rollouts', type=int, default=200)
+    parser.add_argument('--pop-size', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="JSON file to write, stdout if not given")
+    args = parser.parse_args()
+
+    results = run(args.rollouts, args.pop_size, seed=args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,192 @@
+"""
+Island model of the genetic algorithm: independent populations evolve in separate processes and
+periodically send their best chromosomes to neighbouring islands, which keeps the search diverse
+without the hard restart of a single population.
+
+    python islands.py --islands 4 --interval 5 --topology ring
+"""
+import time
+import queue
+import argparse
+import numpy as np
+import multiprocessing as mp
+from typing import Dict, List, Optional
+
+from optimizer import f, Simulator
+from main import GeneticAlgorithm
+
+TOPOLOGIES = ['ring', 'full']
+
+
+def neighbours(idx: int, n_islands: int, topology: str) -> List[int]:
+    # Islands that island idx sends its migrants to
+    if n_islands < 2:
+        return []
+    if topology == 'ring':
+        return [(idx + 1) % n_islands]
+    return [other for other in range(n_islands) if other != idx]
+
+
+def run_island(idx: int, model: Simulator, x0: List[float], ga_kwargs: Dict, seed: np.random.SeedSequence, topology: str,
+               interval: int, n_migrants: int, inboxes: List[mp.Queue], results: mp.Queue):
+    """
+    Runs one island until its best fitness stagnates. Every interval generations its n_migrants fittest
+    chromosomes are sent to its neighbours, and the migrants of every island sending to it replace its
+    least fit chromosomes. Receiving waits for the migrants of the same generation, so a run is
+    reproducible for a given seed. An island that stops tells its neighbours, which then stop waiting for it.
+    """
+    n_islands = len(inboxes)
+    targets = neighbours(idx, n_islands, topology)
+    senders = {other for other in range(n_islands) if idx in neighbours(other, n_islands, topology)}
+    # Migrants that arrived ahead of the generation waiting for them, by sender and generation
+    early: Dict = {}
+    migrations = 0
+
+    ga = GeneticAlgorithm(model, x0, seed=seed, executor='serial', restart=False, verbose=False, **ga_kwargs)
+
+    def migrate(k: int):
+        nonlocal migrations
+        if (k + 1) % interval:
+            return
+
+        migrants = ga.parents[:n_migrants]
+        for target in targets:
+            inboxes[target].put(('migrants', idx, k, migrants))
+
+        received = []
+        for sender in sorted(senders):
+            while (sender, k) not in early and sender in senders:
+                kind, source, generation, payload = inboxes[idx].get()
+                if kind == 'done':
+                    senders.discard(source)
+                else:
+                    early[source, generation] = payload
+            if (sender, k) in early:
+                received.append(early.pop((sender, k)))
+
+        if received:
+            ga.immigrate(np.concatenate(received)[:ga.pop_size - ga.n_parents])
+            migrations += 1
+
+    start_time = time.perf_counter()
+    try:
+        parents, fitnesses = ga.run(migrate)
+    finally:
+        for target in targets:
+            inboxes[target].put(('done', idx, -1, None))
+
+    results.put({
+        'island': idx,
+        'best': parents[0],
+        'fitness': fitnesses[-1],
+        'fitnesses': fitnesses,
+        'generations': len(fitnesses),
+        'migrations': migrations,
+        'seconds': time.perf_counter() - start_time
+    })
+
+
+class IslandModel:
+    def __init__(self, model: Simulator, x0: List[float], n_islands: int = 4, interval: int = 5, n_migrants: int = 2,
+                 topology: str = 'ring', seed: Optional[int] = None, **ga_kwargs):
+        """
+        Runs n_islands GeneticAlgorithm populations, one per process, each with its own copy of the model.
+
+        Parameters
+        ----------
+        model:          Simulator every island evaluates its chromosomes on
+        n_islands:      Number of populations and processes
+        interval:       Generations between migrations
+        n_migrants:     Fittest chromosomes an island sends to each neighbour per migration
+        topology:       'ring' sends to the next island only, 'full' to all other islands
+        seed:           Seed the seeds of the islands are spawned from
+        ga_kwargs:      cross_prob, mutate_prob, pop_size, max_iter and the other GeneticAlgorithm
+                        parameters, shared by all islands. Islands evaluate serially and do not restart
+        """
+        assert topology in TOPOLOGIES, f"Valid topologies are {TOPOLOGIES}, you provided {topology}"
+        assert 0 < n_migrants <= ga_kwargs.get('n_parents', 4), "Migrants are taken from the parents of an island"
+
+        self.model: Simulator = model
+        self.x0: List[float] = x0
+        self.n_islands: int = n_islands
+        self.interval: int = interval
+        self.n_migrants: int = n_migrants
+        self.topology: str = topology
+        self.seeds = np.random.SeedSequence(seed).spawn(n_islands)
+        self.ga_kwargs: Dict = ga_kwargs
+
+        # Results of every island after run, by island
+        self.islands: List[Dict] = []
+
+    def run(self) -> Dict:
+        """
+        Returns the best chromosome over all islands, its fitness and island, and the global convergence:
+        the best fitness of any island per generation, islands that stopped keep their last fitness.
+        The results of each island are kept in self.islands.
+        """
+        ctx = mp.get_context()
+        inboxes = [ctx.Queue() for _ in range(self.n_islands)]
+        results = ctx.Queue()
+
+        processes = [ctx.Process(target=run_island, args=(idx, self.model, self.x0, self.ga_kwargs, self.seeds[idx], self.topology,
+                                                          self.interval, self.n_migrants, inboxes, results))
+                     for idx in range(self.n_islands)]
+        for process in processes:
+            process.start()
+
+        islands = []
+        while len(islands) < self.n_islands:
+            try:
+                islands.append(results.get(timeout=1.0))
+            except queue.Empty:
+                failed = [idx for idx, process in enumerate(processes) if process.exitcode not in (None, 0)]
+                assert not failed, f"Islands {failed} failed"
+
+        # Migrants sent to islands that already stopped are drained, a process exits only once its queues are flushed
+        while any(process.is_alive() for process in processes):
+            for inbox in inboxes:
+                try:
+                    while True:
+                        inbox.get_nowait()
+                except queue.Empty:
+                    pass
+            for process in processes:
+                process.join(timeout=0.05)
+
+        self.islands = sorted(islands, key=lambda island: island['island'])
+        best = min(self.islands, key=lambda island: island['fitness'])
+
+        return {
+            'best': best['best'],
+            'fitness': best['fitness'],
+            'island': best['island'],
+            'fitnesses': self.global_convergence()
+        }
+
+    def global_convergence(self) -> List[float]:
+        generations = max(island['generations'] for island in self.islands)
+        padded = np.array([island['fitnesses'] + island['fitnesses'][-1:] * (generations - island['generations'])
+                           for island in self.islands])
+        return padded.min(axis=0).tolist()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Island model genetic algorithm tuning the PID gains")
+    parser.add_argument('--islands', type=int, default=4)
+    parser.add_argument('--interval', type=int, default=5)
+    parser.add_argument('--migrants', type=int, default=2)
+    parser.add_argument('--topology', choices=TOPOLOGIES, default='ring')
+    parser.add_argument('--pop-size', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    sys = Simulator(model=f, nx=2, nu=1, nsim=30, dt=0.1)
+    islands = IslandModel(sys, [0.0, 0.1], n_islands=args.islands, interval=args.interval, n_migrants=args.migrants,
+                          topology=args.topology, seed=args.seed, cross_prob=0.4, mutate_prob=0.1, pop_size=args.pop_size,
+                          max_iter=1000)
+    result = islands.run()
+
+    for island in islands.islands:
+        print(f"Island {island['island']}: best fitness {island['fitness']} after {island['generations']} generations, "
+              f"{island['migrations']} migrations in {island['seconds']:.2f} s")
+    print(f"Best fitness {result['fitness']} of island {result['island']} with gains {result['best']}")
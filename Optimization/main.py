@@ -1,82 +1,330 @@
-import random
+import os
+import time
 import numpy as np
+import numpy.typing as npt
 import matplotlib.pyplot as plt
-from typing import List, Callable
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import List, Callable, Optional, Tuple, Dict, Iterator
 
 
-from optimizer import f, Simulator
+from optimizer import f, Simulator, FitnessCache, ScenarioSet, ABORT_PENALTY
+from telemetry import save_checkpoint, load_checkpoint
+
+EXECUTORS = {'serial': None, 'threads': ThreadPoolExecutor, 'processes': ProcessPoolExecutor}
+
+
+def evaluate_chunk(model: Simulator, chunk: npt.NDArray[np.floating], x0: List[float], y_idx: int, ref: float,
+                   bound: Optional[float] = None, max_cost: Optional[float] = None, scenarios: Optional[ScenarioSet] = None) -> List[float]:
+    # Module level so process pools can pickle it, the simulator travels with every chunk
+    if scenarios is not None:
+        return model.evolve_scenarios(chunk, scenarios, y_idx, bound=bound, max_cost=max_cost).tolist()
+    return model.evolve_batch_cost(gains=chunk, x0=x0, y_idx=y_idx, ref=ref, bound=bound, max_cost=max_cost).tolist()
 
 
 class GeneticAlgorithm:
-    def __init__(self, model: Simulator, x0: List[float], cross_prob: float, mutate_prob: float, pop_size: int, max_iter: int):
+    def __init__(self, model: Simulator, x0: List[float], cross_prob: float, mutate_prob: float, pop_size: int, max_iter: int,
+                 executor: str = 'serial', workers: Optional[int] = None, chunk_size: Optional[int] = None, seed: Optional[int] = None,
+                 cache_size: int = 0, cache_tol: float = 1e-6, abort_bound: Optional[float] = None, abort_worse: bool = False,
+                 n_genes: Optional[int] = None, n_parents: int = 4, gene_range: Tuple[float, float] = (-100, 100), restart: bool = True,
+                 verbose: bool = True, callbacks: Optional[List[Callable[[Dict], None]]] = None,
+                 checkpoint_path: Optional[str] = None, checkpoint_every: int = 10, scenarios: Optional[ScenarioSet] = None):
         """
         A general genetic algorithm with chromosomes representing PID controller gains.
-        Each chromosome is a list of length 3 representing Kp, Ki, Kd gains of the controller.
+        The population is an array of shape pop_size x n_genes, for a Simulator each chromosome holds the
+        Kp, Ki, Kd gains of the controller. Every generation the n_parents fittest chromosomes are
+        selected, and crossover and mutation act on the whole population at once.
         Parameters
         ----------
         model:              The function to be optimized(minimized)
         cross_prob:     Crossover probability
         mutate_prob:    Mutation probability
         pop_size:       Population size
-        max_iter:       Maximum number of iterations
+        max_iter:       Maximum number of generations, the run stops earlier when the best fitness stagnates
+        executor:       How fitness is evaluated, 'serial', 'threads' or 'processes'
+        workers:        Number of threads or processes, all cores by default
+        chunk_size:     Chromosomes simulated together per task, the population split evenly over the workers by default
+        seed:           Seed of the random number generator, runs with the same seed give the same results
+        cache_size:     Number of fitness values memoized by gains, 0 simulates every chromosome every generation
+        cache_tol:      Gains are rounded to this tolerance to look them up in the cache
+        abort_bound:    Abort the simulation of a chromosome once a state or the input leaves [-abort_bound, abort_bound]
+        abort_worse:    Abort the simulation of a chromosome once its cost exceeds that of the worst parent of the
+                        previous generation. Parents are not carried over, so such a chromosome could still have
+                        been a parent of this generation: the option trades search quality for speed and changes
+                        the results of a seeded run. With scenarios it only applies to the 'worst' aggregation
+                        Aborted chromosomes get a fitness of ABORT_PENALTY or more, see optimizer.abort_cost
+        n_genes:        Genes per chromosome, the model's n_genes by default and it must match it when given
+        n_parents:      Fittest chromosomes kept as parents every generation
+        gene_range:     Genes of the initial (and restarted) population are drawn uniformly from this range
+        restart:        Re-initialize the population when it is stuck above a fitness of 10 after 40% of max_iter
+        verbose:        Print every generation
+        callbacks:      Called with the record of every generation, see generations(), e.g. a telemetry.JSONLSink
+        checkpoint_path: File the state of the run is saved to every checkpoint_every generations and at the end,
+                        resume() continues a run from it
+        scenarios:      Evaluate every chromosome over these scenarios and aggregate their costs, instead of
+                        a single rollout from x0 with the ref of fitness_batch
         """
+        assert executor in EXECUTORS, f"Valid executors are {list(EXECUTORS)}, you provided {executor}"
+        assert 0 < n_parents < pop_size, f"n_parents must be between 1 and pop_size - 1, you provided {n_parents}"
+        n_genes = model.n_genes if n_genes is None else n_genes
+        assert n_genes == model.n_genes, f"The model takes chromosomes of {model.n_genes} genes, you provided {n_genes}"
+
         self.model: Simulator = model
         self.x0: List[float] = x0
         self.cross_prob: float = cross_prob
         self.mutate_prob: float = mutate_prob
         self.pop_size: int = pop_size
         self.max_iter: int = max_iter
+        self.n_genes: int = n_genes
+        self.n_parents: int = n_parents
+        self.gene_range: Tuple[float, float] = gene_range
+        self.restart: bool = restart
+        self.verbose: bool = verbose
+
+        self.executor: str = executor
+        self.workers: Optional[int] = workers
+        self.chunk_size: Optional[int] = chunk_size
+        self.callbacks: List[Callable[[Dict], None]] = callbacks or []
+        self.checkpoint_path: Optional[str] = checkpoint_path
+        self.checkpoint_every: int = checkpoint_every
+        self.scenarios: Optional[ScenarioSet] = scenarios
+
+        # Progress of the run: generations done, consecutive stagnant generations and best fitness of every generation
+        self.generation: int = 0
+        self.cons_fit: int = 0
+        self.fitnesses: List[float] = []
+        # Wall time of every generation in seconds
+        self.generation_times: List[float] = []
+        self.cache: Optional[FitnessCache] = FitnessCache(cache_size, cache_tol) if cache_size else None
+        self.abort_bound: Optional[float] = abort_bound
+        self.abort_worse: bool = abort_worse
+        # Cost above which simulations are aborted, set every generation when abort_worse is on
+        self.max_cost: Optional[float] = None
 
-        self.pop = [[random.uniform(-100, 100) for _ in range(3)] for _ in range(pop_size)]
+        self.rng = np.random.default_rng(seed)
+        self.pop = self.random_population()
+        # Fitness of the last evaluated population and its parents, fittest first
+        self.fits: Optional[npt.NDArray[np.floating]] = None
+        self.parents: Optional[npt.NDArray[np.floating]] = None
+        self.parents_fit: Optional[npt.NDArray[np.floating]] = None
+
+    def random_population(self) -> npt.NDArray[np.floating]:
+        return self.rng.uniform(*self.gene_range, [self.pop_size, self.n_genes])
 
     def fitness(self, x: List[float], y_idx: int = 0, ref: float = 1.0) -> float:
         # TODO: scale the fitness function in a specific range
-        # TODO: y_idx and ref, and put them as class attributes
-        
-        x, u, e = sys.evolve(pid_gains=x, x0=self.x0, y_idx=y_idx, ref=ref)
+        # With scenarios x0 and ref are taken from the scenario set instead
+
+        if self.cache is not None:
+            key = self.cache.key(x, self.x0, y_idx, ref, self.scenarios)
+            e = self._cache_get(key)
+            if e is not None:
+                return e
+
+        if self.scenarios is not None:
+            e = float(self.model.evolve_scenarios(np.array([x]), self.scenarios, y_idx, bound=self.abort_bound, max_cost=self.max_cost)[0])
+        else:
+            e = self.model.evolve_cost(pid_gains=x, x0=self.x0, y_idx=y_idx, ref=ref, bound=self.abort_bound, max_cost=self.max_cost)
+        if self.cache is not None:
+            self._cache_put(key, e)
         return e
 
-    def crossover(self, pars: List[List[float]]):
-        for pop_idx in range(len(self.pop)):
-            random_prop = random.random()
-            random_gain_choice = random.randint(0, 2)
-            if random_prop < self.cross_prob:
-                self.pop[pop_idx][random_gain_choice] = random.choice(pars)[0][random_gain_choice]
-
-    def mutate(self, pars: List[List[float]]):
-        for pop_idx in range(len(self.pop)):
-            random_prop = random.random()
-            random_gain_choice = random.randint(0, 2)
-            if random_prop < self.mutate_prob:
-                self.pop[pop_idx][random_gain_choice] += random.choice(pars)[0][random_gain_choice] * 0.6  # Again, constant for now
-
-    def run(self)-> List[List[float]]:
-        fitnesses = []
-        cons_fit = 0
-
-        k = 0
-        while cons_fit < 15:
-            chromosomes_fitness: List[List[float]] = [[pop, self.fitness(pop)] for pop in self.pop]
-            chromosomes_fitness.sort(key=lambda x: x[1])
-
-            parents = chromosomes_fitness[:4]  # Number of parents is constant for now
+    def fitness_batch(self, pop: npt.NDArray[np.floating], pool: Optional[Executor] = None, y_idx: int = 0,
+                      ref: float = 1.0) -> npt.NDArray[np.floating]:
+        """
+        The fitness of every chromosome (row) of pop, in order. Chromosomes found in the cache are not
+        simulated, the rest is simulated in chunks by Simulator.evolve_batch_cost, on the pool if one is given.
+        """
+        if self.cache is None:
+            return np.array(self._simulate(pop, pool, y_idx, ref))
+
+        keys = self.cache.keys(pop, self.x0, y_idx, ref, self.scenarios)
+        fits = [self._cache_get(key) for key in keys]
+
+        # Copies of a chromosome within the population are simulated once
+        missing = {}
+        for idx, fit in enumerate(fits):
+            if fit is None:
+                missing.setdefault(keys[idx], idx)
+
+        simulated = dict(zip(missing, self._simulate(pop[list(missing.values())], pool, y_idx, ref)))
+        for key, fit in simulated.items():
+            self._cache_put(key, fit)
+
+        return np.array([simulated[key] if fit is None else fit for key, fit in zip(keys, fits)])
+
+    def _cache_get(self, key: Tuple) -> Optional[float]:
+        # A cached cost above the current max_cost is simulated again, the step it is aborted in sets its fitness
+        fit = self.cache.get(key)
+        if fit is not None and self.max_cost is not None and fit > self.max_cost:
+            return None
+        return fit
+
+    def _cache_put(self, key: Tuple, fit: float):
+        # An abort under max_cost only holds for the threshold of this generation, so it is not kept
+        if self.max_cost is None or fit < ABORT_PENALTY:
+            self.cache.put(key, fit)
+
+    def _simulate(self, pop: npt.NDArray[np.floating], pool: Optional[Executor], y_idx: int, ref: float) -> List[float]:
+        if not len(pop):
+            return []
+        if pool is None:
+            return evaluate_chunk(self.model, pop, self.x0, y_idx, ref, self.abort_bound, self.max_cost, self.scenarios)
+
+        workers = self.workers or os.cpu_count()
+        chunk_size = self.chunk_size or -(-len(pop) // workers)
+        chunks = [pop[idx:idx + chunk_size] for idx in range(0, len(pop), chunk_size)]
+
+        # map keeps the order of the chunks, so results do not depend on which worker finishes first
+        results = pool.map(evaluate_chunk, [self.model] * len(chunks), chunks, [self.x0] * len(chunks),
+                           [y_idx] * len(chunks), [ref] * len(chunks), [self.abort_bound] * len(chunks),
+                           [self.max_cost] * len(chunks), [self.scenarios] * len(chunks))
+        return [fit for chunk_fitness in results for fit in chunk_fitness]
+
+    def select(self, fits: npt.NDArray[np.floating]) -> npt.NDArray[np.intp]:
+        # Indices of the n_parents fittest chromosomes, fittest first, without sorting the whole population
+        elite = np.argpartition(fits, self.n_parents - 1)[:self.n_parents]
+        return elite[np.argsort(fits[elite], kind='stable')]
+
+    def _draws(self, prob: float, pars: npt.NDArray[np.floating]):
+        # Chromosomes picked with probability prob, one random gene of each and the same gene of a random parent
+        picked = np.flatnonzero(self.rng.random(len(self.pop)) < prob)
+        genes = self.rng.integers(0, self.n_genes, len(picked))
+        donors = pars[self.rng.integers(0, len(pars), len(picked)), genes]
+        return picked, genes, donors
+
+    def crossover(self, pars: npt.NDArray[np.floating]):
+        picked, genes, donors = self._draws(self.cross_prob, pars)
+        self.pop[picked, genes] = donors
+
+    def mutate(self, pars: npt.NDArray[np.floating]):
+        picked, genes, donors = self._draws(self.mutate_prob, pars)
+        self.pop[picked, genes] += donors * 0.6  # Again, constant for now
+
+    def immigrate(self, migrants: npt.NDArray[np.floating]):
+        # Migrants replace the least fit chromosomes of the last evaluation
+        worst = np.argpartition(self.fits, -len(migrants))[-len(migrants):]
+        self.pop[worst] = migrants
+
+    def state(self) -> Dict:
+        # Everything a run depends on besides the parameters, see resume
+        return {
+            'pop_shape': self.pop.shape,
+            'pop': self.pop,
+            'rng': self.rng.bit_generator.state,
+            'generation': self.generation,
+            'cons_fit': self.cons_fit,
+            'fitnesses': self.fitnesses,
+            'generation_times': self.generation_times,
+            'max_cost': self.max_cost,
+            'fits': self.fits,
+            'parents': self.parents,
+            'parents_fit': self.parents_fit,
+            'cache': None if self.cache is None else self.cache.entries
+        }
+
+    def checkpoint(self, path: Optional[str] = None):
+        save_checkpoint(path or self.checkpoint_path, self.state())
+
+    def resume(self, path: Optional[str] = None) -> bool:
+        """
+        Restores the run saved at path, checkpoint_path by default, so run() continues where it stopped
+        and ends as the uninterrupted run would have. Returns False when there is no checkpoint.
+        """
+        state = load_checkpoint(path or self.checkpoint_path)
+        if state is None:
+            return False
+        assert state['pop_shape'] == self.pop.shape, f"The checkpoint has a population of shape {state['pop_shape']}"
+
+        self.pop = state['pop']
+        self.rng.bit_generator.state = state['rng']
+        self.generation, self.cons_fit = state['generation'], state['cons_fit']
+        self.fitnesses, self.generation_times = state['fitnesses'], state['generation_times']
+        self.max_cost = state['max_cost']
+        self.fits, self.parents, self.parents_fit = state['fits'], state['parents'], state['parents_fit']
+        if self.cache is not None and state['cache'] is not None:
+            self.cache.entries = state['cache']
+        return True
+
+    def run(self, migrate: Optional[Callable[[int], None]] = None) -> Tuple[npt.NDArray[np.floating], List[float]]:
+        """
+        Evolves the population for max_iter generations, or until the best fitness stagnates for 15 generations.
+        migrate is called with the generation number at the end of every generation, the island model
+        exchanges chromosomes with it. Returns the last parents, fittest first, and the best fitness of every generation.
+        """
+        for _ in self.generations(migrate):
+            pass
+        return self.parents, self.fitnesses
+
+    def generations(self, migrate: Optional[Callable[[int], None]] = None) -> Iterator[Dict]:
+        """
+        Runs like run() and yields the record of every generation as it finishes:
+        generation, best and mean fitness (the mean over finite fitnesses, None when every chromosome aborted),
+        diversity (the mean standard deviation of the genes), evaluations, and the seconds spent evaluating
+        and on the whole generation.
+        """
+        pool = None
+        if self.executor != 'serial':
+            pool = EXECUTORS[self.executor](max_workers=self.workers)
+
+        try:
+            yield from self._run(pool, migrate)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            if self.checkpoint_path is not None and self.fits is not None:
+                self.checkpoint()
+
+    def _run(self, pool: Optional[Executor], migrate: Optional[Callable[[int], None]] = None) -> Iterator[Dict]:
+        fitnesses = self.fitnesses
+
+        while self.cons_fit < 15 and self.generation < self.max_iter:
+            k = self.generation
+            start_time = time.perf_counter()
+
+            self.fits = fits = self.fitness_batch(self.pop, pool)
+            eval_seconds = time.perf_counter() - start_time
+            finite = fits[np.isfinite(fits) & (fits < ABORT_PENALTY)]
+            mean = float(np.mean(finite)) if len(finite) else None
+            diversity = float(np.mean(np.std(self.pop, axis=0)))
+
+            elite = self.select(fits)
+            self.parents, self.parents_fit = parents, parents_fit = self.pop[elite], fits[elite]
+            if self.abort_worse and (self.scenarios is None or self.scenarios.aggregation == 'worst'):
+                # When even the worst parent was aborted the threshold carries no signal, the next generation runs without it
+                # The slack keeps the rounding of the running cost sums from aborting the worst parent itself
+                worst = float(parents_fit[-1])
+                self.max_cost = worst + 1e-9 * max(1.0, abs(worst)) if worst < ABORT_PENALTY else None
             self.crossover(parents)
             self.mutate(parents)
 
-            if k > int(0.4 * self.max_iter) and parents[0][1] > 10:
+            if self.restart and k > int(0.4 * self.max_iter) and parents_fit[0] > 10:
                 # This is a safeguard, escape local minima by re-initializing
-                self.pop = [[random.uniform(-100, 100) for _ in range(3)] for _ in range(self.pop_size)]
+                self.pop = self.random_population()
+                # The parents are not kept, a fresh population is compared with itself
+                self.max_cost = None
+
+            if migrate is not None:
+                migrate(k)
 
-            fitnesses.append(parents[0][1])
+            fitnesses.append(float(parents_fit[0]))
 
             if np.isclose(fitnesses[k], fitnesses[k-1], atol=1e-3):
-                print(f'Reaching stagnation {cons_fit}/15')
-                cons_fit += 1
+                if self.verbose:
+                    print(f'Reaching stagnation {self.cons_fit}/15')
+                self.cons_fit += 1
 
-            print(f"Epoch {k} with best fitness {fitnesses[-1]}")
-            k += 1
+            self.generation_times.append(time.perf_counter() - start_time)
+            if self.verbose:
+                print(f"Epoch {k} with best fitness {fitnesses[-1]} in {self.generation_times[-1] * 1000:.1f} ms")
+            self.generation += 1
 
-        return parents, fitnesses
+            record = {'generation': k, 'best': fitnesses[-1], 'mean': mean, 'diversity': diversity, 'evaluations': len(fits),
+                      'eval_seconds': eval_seconds, 'seconds': self.generation_times[-1]}
+            for callback in self.callbacks:
+                callback(record)
+            if self.checkpoint_path is not None and self.generation % self.checkpoint_every == 0:
+                self.checkpoint()
+            yield record
 
 if __name__ == "__main__":
     """
@@ -86,14 +334,17 @@ if __name__ == "__main__":
     X0 = [0.0, 0.1]
 
     sys = Simulator(model=f, nx=2, nu=1, nsim=30, dt=0.1)
-    opt = GeneticAlgorithm(sys, X0, cross_prob=0.4, mutate_prob=0.1, pop_size=100, max_iter=1000)
+    opt = GeneticAlgorithm(sys, X0, cross_prob=0.4, mutate_prob=0.1, pop_size=100, max_iter=1000, executor='processes', seed=0,
+                           cache_size=10000)
 
     res, fit = opt.run()
+    if opt.cache is not None:
+        print(f"Fitness cache {opt.cache.stats()}")
 
     plt.figure()
     plt.grid()
 
-    x, u, e = sys.evolve(pid_gains=res[0][0], x0=[0.0, 0.5], y_idx=0, ref=10)
+    x, u, e = sys.evolve(pid_gains=res[0], x0=[0.0, 0.5], y_idx=0, ref=10)
 
     plt.plot(x)
     plt.plot(u, '--')
@@ -1,10 +1,18 @@
 import numpy as np
 import numpy.typing as npt
 import matplotlib.pyplot as plt
-from typing import Callable, List
+import inspect
+from scipy.linalg import expm
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple, Union
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
-def f(x: npt.NDArray[np.floating], u: npt.NDArray[np.floating]) -> npt.NDArray[np.floating]:
+
+def f(x: npt.NDArray[np.floating], u: npt.NDArray[np.floating], out: Optional[npt.NDArray[np.floating]] = None) -> npt.NDArray[np.floating]:
     """
     A numerical evaluation of the plant with n number of states and o number of inputs.
 
@@ -16,53 +24,716 @@ def f(x: npt.NDArray[np.floating], u: npt.NDArray[np.floating]) -> npt.NDArray[n
     u: npt.NDArray[np.floating]
     The current input vector of shape ox1
 
+    out: npt.NDArray[np.floating], optional
+    Array shaped like x the derivatives are written to, a new one by default
+
     Returns
     -------
     x_next: npt.NDArray[np.floating]
     Returning a state vector with the derivatives, to be used by an integrator.
     """
 
-    x_dot = [x[1], u[0]]
+    x_dot = np.empty_like(x) if out is None else out
+    x_dot[0] = x[1]
+    x_dot[1] = u[0]
+
+    return x_dot
+
+# The plant of f as a linear state-space description, x_dot = A x + B u
+F_A = np.array([[0.0, 1.0], [0.0, 0.0]])
+F_B = np.array([[0.0], [1.0]])
+
+
+def discretize(A: npt.NDArray[np.floating], B: npt.NDArray[np.floating], dt: float):
+    """
+    Exact zero order hold discretization of x_dot = A x + B u, from the matrix exponential of [[A, B], [0, 0]] dt.
+
+    Returns
+    -------
+    Ad, Bd: npt.NDArray[np.floating]
+    The transition matrices of x[k+1] = Ad x[k] + Bd u[k]
+    """
+    nx, nu = B.shape
+    M = np.zeros([nx + nu, nx + nu])
+    M[:nx, :nx] = A
+    M[:nx, nx:] = B
+    E = expm(M * dt)
+
+    return E[:nx, :nx], E[:nx, nx:]
+
+
+# Least cost of a rollout aborted by the bound or max_cost of Simulator.evolve, above any cost worth keeping
+ABORT_PENALTY = 1e9
+# Steps evolve_batch simulates between checks of bound and max_cost
+ABORT_CHECK_STEPS = 10
+
+
+def abort_cost(steps, n):
+    """
+    Cost of a rollout of n steps aborted in step number steps, between ABORT_PENALTY and twice that.
+    The longer a rollout lasted the lower it is, so selection still ranks the chromosomes when most
+    of them abort. Steps are counted up to the next check of evolve_batch, so every path grades alike.
+    """
+    checked = min(-(-steps // ABORT_CHECK_STEPS) * ABORT_CHECK_STEPS, n)
+    return ABORT_PENALTY * (2.0 - checked / n)
+
+ABORT_COST = njit(cache=True)(abort_cost) if njit is not None else abort_cost
+
+
+def pid_rollout(Ad, Bd, X, U, e, kp, ki, kd, dt, y_idx, ref, bound=np.inf, max_cost=np.inf):
+    """
+    The PID loop of Simulator.evolve on a discretized linear plant, filling the preallocated X, U and e.
+    Written as plain loops over floats so numba can compile it, see PID_ROLLOUT.
+    Returns the step, counted from 1, in which the rollout was aborted by bound or max_cost, 0 when it was not.
+    """
+    nx, nu = Bd.shape
+    a0 = kp + ki*dt + kd/dt
+    a1 = -kp - 2 * (kd/dt)
+    a2 = kd / dt
+
+    n = len(e)
+    sum_e2, sum_u2, max_u = 0.0, 0.0, -np.inf
+    u = 0.0
+    for k in range(n):
+        e[k] = ref - X[k, y_idx]
+        if k >= 2:
+            u = u + a0 * e[k] + a1 * e[k-1] + a2 * e[k-2]
+
+        for j in range(nu):
+            U[k, j] = u
+        for i in range(nx):
+            acc = 0.0
+            for j in range(nx):
+                acc += Ad[i, j] * X[k, j]
+            for j in range(nu):
+                acc += Bd[i, j] * u
+            X[k+1, i] = acc
+            # Written so that NaN aborts as well
+            if not abs(acc) <= bound:
+                return k + 1
+
+        # The cost so far is a lower bound of the final cost
+        sum_e2 += e[k] * e[k]
+        sum_u2 += nu * u * u
+        max_u = max(max_u, u)
+        if not abs(u) <= bound or sum_e2 / n + 10 * sum_u2 / n + 40 * max_u > max_cost:
+            return k + 1
+
+    return 0
+
+
+def pid_rollout_cost(Ad, Bd, x, x_next, n, kp, ki, kd, dt, y_idx, ref, bound=np.inf, max_cost=np.inf):
+    """
+    The cost of pid_rollout without its trajectories, the state alternates between the buffers x and x_next
+    and the errors between three floats. Returns the abort_cost of the step aborted by bound or max_cost.
+    """
+    nx, nu = Bd.shape
+    a0 = kp + ki*dt + kd/dt
+    a1 = -kp - 2 * (kd/dt)
+    a2 = kd / dt
+
+    sum_e2, sum_u2, max_u = 0.0, 0.0, -np.inf
+    e1, e2 = 0.0, 0.0
+    u = 0.0
+    for k in range(n):
+        e0 = ref - x[y_idx]
+        if k >= 2:
+            u = u + a0 * e0 + a1 * e1 + a2 * e2
+        e2, e1 = e1, e0
+
+        for i in range(nx):
+            acc = 0.0
+            for j in range(nx):
+                acc += Ad[i, j] * x[j]
+            for j in range(nu):
+                acc += Bd[i, j] * u
+            x_next[i] = acc
+            if not abs(acc) <= bound:
+                return ABORT_COST(k + 1, n)
+        x, x_next = x_next, x
+
+        sum_e2 += e0 * e0
+        sum_u2 += nu * u * u
+        max_u = max(max_u, u)
+        if not abs(u) <= bound or sum_e2 / n + 10 * sum_u2 / n + 40 * max_u > max_cost:
+            return ABORT_COST(k + 1, n)
+
+    return sum_e2 / n + 10 * sum_u2 / n + 40 * max_u
+
+# JIT compiled when numba is installed, plain Python otherwise
+PID_ROLLOUT = njit(cache=True)(pid_rollout) if njit is not None else pid_rollout
+PID_ROLLOUT_COST = njit(cache=True)(pid_rollout_cost) if njit is not None else pid_rollout_cost
+
+def _accepts_out(model: Callable) -> bool:
+    try:
+        return 'out' in inspect.signature(model).parameters
+    except (TypeError, ValueError):
+        return False
 
-    return np.array(x_dot)
 
 class Simulator:
-    def __init__(self, model: Callable, nx: int, nu: int, nsim: int, dt: float):
+    def __init__(self, model: Union[Callable, Tuple[npt.NDArray[np.floating], npt.NDArray[np.floating]]], nx: int, nu: int, nsim: int, dt: float):
+        """
+        Closed loop PID simulation of a plant.
+
+        Parameters
+        ----------
+        model: Callable or (A, B)
+        The derivatives of the plant as f(x, u), integrated with RK4. A linear plant can be
+        given as its state-space matrices (A, B) instead, it is then discretized exactly once
+        and stepped as x[k+1] = Ad x[k] + Bd u[k].
+        """
         self.model = model
         self.nx = nx
         self.nu = nu
         self.nsim = nsim
         self.dt = dt
+        # Genes of the chromosomes the genetic algorithm tunes, the Kp, Ki and Kd gains
+        self.n_genes: int = 3
+
+        self.linear: bool = not callable(model)
+        # Models taking an out array, as f does, let RK4_step reuse its stage buffers
+        self.model_out: bool = not self.linear and _accepts_out(model)
+        if self.linear:
+            A, B = (np.asarray(matrix, dtype=float) for matrix in model)
+            assert A.shape == (nx, nx) and B.shape == (nx, nu), f"A must be {nx}x{nx} and B {nx}x{nu}, you provided {A.shape} and {B.shape}"
+            self.Ad, self.Bd = discretize(A, B, dt)
+
+    def evolve(self, pid_gains: List[float], x0: List[float], y_idx: int, ref: float,
+               bound: Optional[float] = None, max_cost: Optional[float] = None):
+        """
+        Simulates the closed loop with the PID gains and returns the trajectories and their cost.
 
+        Parameters
+        ----------
+        bound: float, optional
+        Abort as soon as a state or the input leaves [-bound, bound]
+
+        max_cost: float, optional
+        Abort as soon as the cost so far, a lower bound of the final cost, exceeds max_cost
+
+        Returns
+        -------
+        X, U, cost:
+        The state and input trajectories and the cost. An aborted rollout leaves the rest of X
+        and U as NaN and costs the abort_cost of the step it was aborted in.
+        """
+        if self.linear:
+            return self.evolve_linear(pid_gains, x0, y_idx, ref, bound, max_cost)
 
-    def evolve(self, pid_gains: List[float], x0: List[float], y_idx: int, ref: float):
         kp, ki, kd = pid_gains
+        n_steps = int(self.nsim / self.dt)
+        early = bound is not None or max_cost is not None
+        sum_e2, sum_u2, max_u = 0.0, 0.0, -np.inf
 
-        X = np.full([int(self.nsim / self.dt), self.nx], np.nan)
+        a0 = kp + ki*self.dt + kd/self.dt
+        a1 = -kp - 2 * (kd/self.dt)
+        a2 = kd / self.dt
+
+        X = np.full([n_steps, self.nx], np.nan)
         X[0] = x0
-        U = np.full([int(self.nsim / self.dt)-1, self.nu], np.nan)
-        e = np.full([int(self.nsim / self.dt)-1, 1], np.nan)
+        U = np.full([n_steps-1, self.nu], np.nan)
+        e = np.full(n_steps-1, np.nan)
+        # Reused by every RK4 step, the loop allocates nothing when the model takes an out array
+        scratch = self.scratch(self.nx)
 
-        for k in range(int(self.nsim / self.dt)-1):
+        u = 0.0
+        for k in range(n_steps-1):
             e[k] = ref - X[k, y_idx]
 
             if k >= 2:
-                a0 = kp + ki*self.dt + kd/self.dt
-                a1 = -kp - 2 * (kd/self.dt)
-                a2 = kd / self.dt
+                u = u + a0 * e[k] + a1 * e[k-1] + a2 * e[k-2]
+            U[k] = u
 
-                U[k] = U[k-1] + a0 * e[k] + a1 * e[k-1] + a2 * e[k-2]
-            else:
-                U[k] = np.array([0.0])
+            self.RK4_step(X[k], U[k], out=X[k+1], scratch=scratch)
+
+            if early:
+                sum_e2 += e[k] ** 2
+                sum_u2 += self.nu * u ** 2
+                max_u = max(max_u, u)
+                if bound is not None and not max(np.max(np.abs(X[k+1])), abs(u)) <= bound:
+                    return X, U, abort_cost(k + 1, len(e))
+                if max_cost is not None and sum_e2 / len(e) + 10 * sum_u2 / len(U) + 40 * max_u > max_cost:
+                    return X, U, abort_cost(k + 1, len(e))
+
+        return X, U, float(np.sum(e**2) / len(e)) + 10*float(np.sum(U**2) / len(U)) + 40 * np.max(U)
+
+    def evolve_linear(self, pid_gains: List[float], x0: List[float], y_idx: int, ref: float,
+                      bound: Optional[float] = None, max_cost: Optional[float] = None):
+        # evolve on the discretized plant, the whole horizon runs in PID_ROLLOUT
+        kp, ki, kd = pid_gains
+        n_steps = int(self.nsim / self.dt)
 
-            X[k+1] = self.RK4_step(X[k], U[k])
+        X = np.full([n_steps, self.nx], np.nan)
+        X[0] = x0
+        U = np.full([n_steps-1, self.nu], np.nan)
+        e = np.full(n_steps-1, np.nan)
+        aborted = PID_ROLLOUT(self.Ad, self.Bd, X, U, e, float(kp), float(ki), float(kd), self.dt, y_idx, float(ref),
+                              np.inf if bound is None else float(bound), np.inf if max_cost is None else float(max_cost))
+        if aborted:
+            return X, U, abort_cost(aborted, len(e))
 
         return X, U, float(np.sum(e**2) / len(e)) + 10*float(np.sum(U**2) / len(U)) + 40 * np.max(U)
 
-    def RK4_step(self, x: npt.NDArray[np.floating], u: npt.NDArray[np.floating]) -> npt.NDArray[np.floating]:
-        k1 = self.model(x, u)
-        k2 = self.model(x + k1 * self.dt / 2, u)
-        k3 = self.model(x + k2 * self.dt / 2, u)
-        k4 = self.model(x + k3 * self.dt,     u)
+    def evolve_cost(self, pid_gains: List[float], x0: List[float], y_idx: int, ref: float,
+                    bound: Optional[float] = None, max_cost: Optional[float] = None) -> float:
+        """
+        The cost of evolve without its trajectories. The state alternates between two preallocated
+        buffers and the cost is accumulated as the rollout goes, so nothing grows with the horizon.
+        It equals the cost of evolve up to the rounding of the sums.
+        """
+        kp, ki, kd = float(pid_gains[0]), float(pid_gains[1]), float(pid_gains[2])
+        n = int(self.nsim / self.dt) - 1
+        bound = np.inf if bound is None else float(bound)
+        max_cost = np.inf if max_cost is None else float(max_cost)
+
+        x, x_next = np.array(x0, dtype=float), np.empty(self.nx)
+        if self.linear:
+            return float(PID_ROLLOUT_COST(self.Ad, self.Bd, x, x_next, n, kp, ki, kd, self.dt, y_idx, float(ref), bound, max_cost))
+
+        a0 = kp + ki*self.dt + kd/self.dt
+        a1 = -kp - 2 * (kd/self.dt)
+        a2 = kd / self.dt
+
+        early = bound < np.inf or max_cost < np.inf
+        u_buf = np.zeros(self.nu)
+        scratch = self.scratch(self.nx)
+        sum_e2, sum_u2, max_u = 0.0, 0.0, -np.inf
+        e1, e2 = 0.0, 0.0
+        u = 0.0
+        for k in range(n):
+            e0 = ref - float(x[y_idx])
+            if k >= 2:
+                u = u + a0 * e0 + a1 * e1 + a2 * e2
+                u_buf.fill(u)
+            e2, e1 = e1, e0
+
+            self.RK4_step(x, u_buf, out=x_next, scratch=scratch)
+            x, x_next = x_next, x
+
+            sum_e2 += e0 * e0
+            sum_u2 += self.nu * u * u
+            max_u = max(max_u, u)
+            if early and (not max(np.max(np.abs(x)), abs(u)) <= bound or sum_e2 / n + 10 * sum_u2 / n + 40 * max_u > max_cost):
+                return abort_cost(k + 1, n)
+
+        return sum_e2 / n + 10 * sum_u2 / n + 40 * max_u
+
+    def evolve_batch(self, gains: npt.NDArray[np.floating], x0: Union[List[float], npt.NDArray[np.floating]], y_idx: int,
+                     ref: Union[float, npt.NDArray[np.floating]], bound: Optional[float] = None, max_cost: Optional[float] = None,
+                     disturbance: Optional[npt.NDArray[np.floating]] = None):
+        """
+        The closed loop of evolve for a whole population of PID gains at once, every step is an
+        array operation over the population axis instead of one Python rollout per individual.
+
+        Parameters
+        ----------
+        gains: npt.NDArray[np.floating]
+        The PID gains of shape Px3, one row of Kp, Ki, Kd per individual
+
+        x0, y_idx, ref, bound, max_cost:
+        As in evolve, shared by all individuals. x0 may also be of shape Pxnx and ref of shape P,
+        one per individual. Aborted individuals are dropped from the remaining steps, so the
+        batch gets cheaper as they diverge
+
+        disturbance: npt.NDArray[np.floating], optional
+        Constant input disturbance added to the controller output before it enters the plant,
+        of shape nu shared by all individuals or Pxnu. It is not part of the input cost
+
+        Returns
+        -------
+        X: npt.NDArray[np.floating]
+        The state trajectories of shape PxNxnx
+
+        U: npt.NDArray[np.floating]
+        The input trajectories of shape Px(N-1)xnu
+
+        cost: npt.NDArray[np.floating]
+        The cost of every individual of shape P, as evolve computes it
+
+        Notes
+        -----
+        The model is called with states of shape nxP and inputs of shape nuxP, so it must
+        broadcast over a trailing axis, as f does. Linear plants step with Ad and Bd instead.
+        """
+        gains = np.atleast_2d(np.asarray(gains, dtype=float))
+        kp, ki, kd = gains[:, 0], gains[:, 1], gains[:, 2]
+        n_steps = int(self.nsim / self.dt)
+
+        # Population on the last axis, so x[i] is state i of every individual
+        X = np.full([n_steps, self.nx, len(gains)], np.nan)
+        X[0] = np.asarray(x0, dtype=float).reshape(-1, self.nx).T
+        U = np.full([n_steps-1, self.nu, len(gains)], np.nan)
+        e = np.full([n_steps-1, len(gains)], np.nan)
+        ref = np.broadcast_to(np.asarray(ref, dtype=float), len(gains))
+        if disturbance is not None:
+            disturbance = np.broadcast_to(np.asarray(disturbance, dtype=float).reshape(-1, self.nu).T, (self.nu, len(gains)))
+
+        a0 = kp + ki*self.dt + kd/self.dt
+        a1 = -kp - 2 * (kd/self.dt)
+        a2 = kd / self.dt
+
+        # Individuals still simulated, a slice until the first one is aborted so the common case does not copy
+        early = bound is not None or max_cost is not None
+        lanes = slice(None)
+        scratch = self.scratch((self.nx, len(gains)))
+        if early:
+            alive = np.arange(len(gains))
+            aborted = np.zeros(len(gains), dtype=bool)
+            penalty = np.zeros(len(gains))
+            sum_e2, sum_u2, max_u = np.zeros(len(gains)), np.zeros(len(gains)), np.full(len(gains), -np.inf)
+            checked = 0
+
+        for k in range(n_steps-1):
+            e[k, lanes] = ref[lanes] - X[k, y_idx, lanes]
+
+            if k >= 2:
+                U[k][:, lanes] = U[k-1][:, lanes] + a0[lanes] * e[k, lanes] + a1[lanes] * e[k-1, lanes] + a2[lanes] * e[k-2, lanes]
+            else:
+                U[k] = 0.0
+
+            if disturbance is None and isinstance(lanes, slice):
+                self.step(X[k], U[k], out=X[k+1], scratch=scratch)
+            elif disturbance is None:
+                X[k+1][:, lanes] = self.step(X[k][:, lanes], U[k][:, lanes])
+            else:
+                X[k+1][:, lanes] = self.step(X[k][:, lanes], U[k][:, lanes] + disturbance[:, lanes])
+
+            # The steps since the last check are checked together, the final check makes the aborted
+            # individuals the same as with evolve
+            if early and ((k+1) % ABORT_CHECK_STEPS == 0 or k == n_steps-2):
+                block = slice(checked, k+1)
+                checked = k+1
+                u_block = U[block][:, :, lanes]
+                sum_e2[alive] += np.sum(e[block, lanes] ** 2, axis=0)
+                sum_u2[alive] += np.sum(u_block ** 2, axis=(0, 1))
+                max_u[alive] = np.maximum(max_u[alive], np.max(u_block, axis=(0, 1)))
+
+                dead = np.zeros(len(alive), dtype=bool)
+                if bound is not None:
+                    x_block = X[block.start+1:block.stop+1][:, :, lanes]
+                    dead |= ~(np.maximum(np.max(np.abs(x_block), axis=(0, 1)), np.max(np.abs(u_block), axis=(0, 1))) <= bound)
+                if max_cost is not None:
+                    dead |= sum_e2[alive] / len(e) + 10 * sum_u2[alive] / len(U) + 40 * max_u[alive] > max_cost
+                if dead.any():
+                    aborted[alive[dead]] = True
+                    penalty[alive[dead]] = abort_cost(k + 1, len(e))
+                    alive = lanes = alive[~dead]
+                    if not len(alive):
+                        break
+
+        cost = np.sum(e**2, axis=0) / len(e) + 10*np.sum(U**2, axis=(0, 1)) / len(U) + 40 * np.max(U, axis=(0, 1))
+        if early:
+            cost[aborted] = penalty[aborted]
+
+        return X.transpose(2, 0, 1), U.transpose(2, 0, 1), cost
+
+    def scratch(self, shape) -> Tuple[npt.NDArray[np.floating], ...]:
+        # Buffers of step and RK4_step for states of the given shape: the four stages, the stage state and the sum
+        return tuple(np.empty(shape) for _ in range(6))
+
+    def evolve_batch_cost(self, gains: npt.NDArray[np.floating], x0: Union[List[float], npt.NDArray[np.floating]], y_idx: int,
+                          ref: Union[float, npt.NDArray[np.floating]], bound: Optional[float] = None,
+                          max_cost: Optional[float] = None, disturbance: Optional[npt.NDArray[np.floating]] = None
+                          ) -> npt.NDArray[np.floating]:
+        """
+        The cost of evolve_batch without its trajectories, with the same parameters. Every array of the
+        loop is allocated before it, states alternate between two buffers and the cost is accumulated as
+        the rollout goes, so a step allocates nothing when the model takes an out array. Aborted individuals
+        are removed from the buffers at the checks, the only point where the loop reallocates.
+        The costs equal those of evolve_batch up to the rounding of the sums.
+        """
+        gains = np.atleast_2d(np.asarray(gains, dtype=float))
+        n_pop = len(gains)
+        n = int(self.nsim / self.dt) - 1
+        early = bound is not None or max_cost is not None
+
+        # Per individual state, population on the last axis as in evolve_batch
+        lane = {
+            'a0': gains[:, 0] + gains[:, 1]*self.dt + gains[:, 2]/self.dt,
+            'a1': -gains[:, 0] - 2 * (gains[:, 2]/self.dt),
+            'a2': gains[:, 2] / self.dt,
+            'ref': np.array(np.broadcast_to(np.asarray(ref, dtype=float), n_pop)),
+            'x': np.array(np.broadcast_to(np.asarray(x0, dtype=float).reshape(-1, self.nx).T, (self.nx, n_pop))),
+            'u': np.zeros(n_pop),
+            'e1': np.zeros(n_pop),
+            'e2': np.zeros(n_pop),
+            'sum_e2': np.zeros(n_pop),
+            'sum_u2': np.zeros(n_pop),
+            'max_u': np.full(n_pop, -np.inf),
+            'peak': np.zeros(n_pop),
+            'idx': np.arange(n_pop)
+        }
+        if disturbance is not None:
+            lane['d'] = np.array(np.broadcast_to(np.asarray(disturbance, dtype=float).reshape(-1, self.nu).T, (self.nu, n_pop)))
+
+        def buffers(size: int):
+            # Work arrays of the loop, their content does not survive a step
+            return np.empty(size), np.empty(size), np.empty([self.nu, size]), np.empty([self.nx, size]), np.empty([self.nx, size]), \
+                self.scratch((self.nx, size))
+
+        e0, tmp, u_in, x_next, abs_x, scratch = buffers(n_pop)
+        cost = np.empty(n_pop)
+        for k in range(n):
+            x, u, e1, e2 = lane['x'], lane['u'], lane['e1'], lane['e2']
+            np.subtract(lane['ref'], x[y_idx], out=e0)
+            if k >= 2:
+                np.multiply(lane['a0'], e0, out=tmp)
+                u += tmp
+                np.multiply(lane['a1'], e1, out=tmp)
+                u += tmp
+                np.multiply(lane['a2'], e2, out=tmp)
+                u += tmp
+
+            u_in[...] = u
+            if disturbance is not None:
+                u_in += lane['d']
+            self.step(x, u_in, out=x_next, scratch=scratch)
+
+            # The oldest error buffer takes the next error, the new state becomes x
+            lane['e1'], lane['e2'], e0 = e0, e1, e2
+            lane['x'], x_next = x_next, x
+
+            np.multiply(lane['e1'], lane['e1'], out=tmp)
+            lane['sum_e2'] += tmp
+            np.multiply(u, u, out=tmp)
+            if self.nu != 1:
+                tmp *= self.nu
+            lane['sum_u2'] += tmp
+            np.maximum(lane['max_u'], u, out=lane['max_u'])
+            if bound is not None:
+                np.abs(lane['x'], out=abs_x)
+                np.max(abs_x, axis=0, out=tmp)
+                np.maximum(lane['peak'], tmp, out=lane['peak'])
+                np.abs(u, out=tmp)
+                np.maximum(lane['peak'], tmp, out=lane['peak'])
+
+            # Checked every ABORT_CHECK_STEPS steps as in evolve_batch, aborted individuals leave the buffers
+            if early and ((k+1) % ABORT_CHECK_STEPS == 0 or k == n-1):
+                dead = np.zeros(len(u), dtype=bool)
+                if bound is not None:
+                    dead |= ~(lane['peak'] <= bound)
+                if max_cost is not None:
+                    dead |= lane['sum_e2'] / n + 10 * lane['sum_u2'] / n + 40 * lane['max_u'] > max_cost
+                if dead.any():
+                    cost[lane['idx'][dead]] = abort_cost(k + 1, n)
+                    keep = ~dead
+                    lane = {name: values[..., keep] for name, values in lane.items()}
+                    e0, tmp, u_in, x_next, abs_x, scratch = buffers(int(keep.sum()))
+                    if not keep.any():
+                        break
+
+        cost[lane['idx']] = lane['sum_e2'] / n + 10 * lane['sum_u2'] / n + 40 * lane['max_u']
+        return cost
+
+    def step(self, x: npt.NDArray[np.floating], u: npt.NDArray[np.floating], out: Optional[npt.NDArray[np.floating]] = None,
+             scratch: Optional[Tuple[npt.NDArray[np.floating], ...]] = None) -> npt.NDArray[np.floating]:
+        # With out and scratch, see Simulator.scratch, the step writes into out without allocating
+        if self.linear:
+            if out is None:
+                return self.Ad @ x + self.Bd @ u
+            np.matmul(self.Ad, x, out=out)
+            np.matmul(self.Bd, u, out=scratch[-1])
+            out += scratch[-1]
+            return out
+
+        return self.RK4_step(x, u, out, scratch)
+
+    def _derivative(self, x: npt.NDArray[np.floating], u: npt.NDArray[np.floating], out: npt.NDArray[np.floating]) -> npt.NDArray[np.floating]:
+        return self.model(x, u, out=out) if self.model_out else self.model(x, u)
+
+    def RK4_step(self, x: npt.NDArray[np.floating], u: npt.NDArray[np.floating], out: Optional[npt.NDArray[np.floating]] = None,
+                 scratch: Optional[Tuple[npt.NDArray[np.floating], ...]] = None) -> npt.NDArray[np.floating]:
+        """
+        One RK4 step from x under the input u. With out and scratch, see Simulator.scratch, the stages
+        and the sum are computed in place, in the same order of operations so the result is identical.
+        Nothing is allocated when the model takes an out array.
+        """
+        if out is None:
+            k1 = self.model(x, u)
+            k2 = self.model(x + k1 * self.dt / 2, u)
+            k3 = self.model(x + k2 * self.dt / 2, u)
+            k4 = self.model(x + k3 * self.dt,     u)
+
+            return x + self.dt * (k1 + 2 * k2 + 2 * k3 + k4) / 6
+
+        k1, k2, k3, k4, stage, acc = scratch
+        k1 = self._derivative(x, u, k1)
+        np.multiply(k1, self.dt, out=stage)
+        stage /= 2
+        stage += x
+        k2 = self._derivative(stage, u, k2)
+        np.multiply(k2, self.dt, out=stage)
+        stage /= 2
+        stage += x
+        k3 = self._derivative(stage, u, k3)
+        np.multiply(k3, self.dt, out=stage)
+        stage += x
+        k4 = self._derivative(stage, u, k4)
+
+        np.multiply(k2, 2, out=acc)
+        acc += k1
+        np.multiply(k3, 2, out=stage)
+        acc += stage
+        acc += k4
+        acc *= self.dt
+        acc /= 6
+        np.add(x, acc, out=out)
+        return out
+
+
+    def evolve_scenarios(self, gains: npt.NDArray[np.floating], scenarios: 'ScenarioSet', y_idx: int,
+                         bound: Optional[float] = None, max_cost: Optional[float] = None) -> npt.NDArray[np.floating]:
+        """
+        The cost of every individual of gains over every scenario, aggregated as the scenario set asks.
+        All individuals and scenarios are simulated as one evolve_batch_cost, so a scenario adds lanes to
+        the array operations rather than Python rollouts.
+
+        Returns
+        -------
+        cost: npt.NDArray[np.floating]
+        The aggregated cost of every individual of shape P
+        """
+        gains = np.atleast_2d(np.asarray(gains, dtype=float))
+        n_scenarios = len(scenarios)
+
+        # Lane p * S + s simulates individual p in scenario s
+        cost = self.evolve_batch_cost(np.repeat(gains, n_scenarios, axis=0), np.tile(scenarios.x0, (len(gains), 1)), y_idx,
+                                      np.tile(scenarios.ref, len(gains)), bound=bound,
+                                      max_cost=max_cost if scenarios.aggregation == 'worst' else None,
+                                      disturbance=np.tile(scenarios.disturbance, (len(gains), 1)) if scenarios.disturbance.any() else None)
+
+        return scenarios.aggregate(cost.reshape(len(gains), n_scenarios))
+
+
+AGGREGATIONS = ['mean', 'worst', 'cvar']
+
+
+class ScenarioSet:
+    def __init__(self, x0: npt.NDArray[np.floating], ref: npt.NDArray[np.floating],
+                 disturbance: Optional[npt.NDArray[np.floating]] = None, aggregation: str = 'mean', alpha: float = 0.2):
+        """
+        Operating conditions a controller is tuned for, scenario s starts at x0[s], tracks ref[s] and
+        sees the constant input disturbance disturbance[s].
+
+        Parameters
+        ----------
+        x0: npt.NDArray[np.floating]
+        Initial states of shape Sxnx
+
+        ref: npt.NDArray[np.floating]
+        References of shape S
+
+        disturbance: npt.NDArray[np.floating], optional
+        Input disturbances of shape Sxnu, none by default
+
+        aggregation: str
+        How the costs of the scenarios make one cost, 'mean', 'worst' (the maximum) or 'cvar',
+        the mean of the alpha fraction of worst scenarios
+
+        alpha: float
+        Fraction of scenarios the CVaR averages, at least one scenario
+
+        Notes
+        -----
+        The cost grows with the reference, so large references weigh more unless the scenarios
+        are chosen to compensate for it. Only 'worst' lets the simulator abort on max_cost, one
+        scenario above it is enough to exceed it.
+        """
+        assert aggregation in AGGREGATIONS, f"Valid aggregations are {AGGREGATIONS}, you provided {aggregation}"
+        assert 0 < alpha <= 1, f"alpha must be in (0, 1], you provided {alpha}"
+
+        self.x0 = np.atleast_2d(np.asarray(x0, dtype=float))
+        self.ref = np.atleast_1d(np.asarray(ref, dtype=float))
+        self.disturbance = np.zeros([len(self.ref), 1]) if disturbance is None else \
+            np.asarray(disturbance, dtype=float).reshape(len(self.ref), -1)
+        assert len(self.x0) == len(self.ref), "x0 and ref must hold the same number of scenarios"
+        self.aggregation = aggregation
+        self.alpha = alpha
+
+    @classmethod
+    def product(cls, x0s: List[List[float]], refs: List[float], disturbances: Optional[List[float]] = None, **kwargs) -> 'ScenarioSet':
+        # Every combination of the initial states, references and disturbances
+        disturbances = [0.0] if disturbances is None else disturbances
+        combos = [(x0, ref, d) for x0 in x0s for ref in refs for d in disturbances]
+        return cls([c[0] for c in combos], [c[1] for c in combos], [np.atleast_1d(c[2]) for c in combos], **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.ref)
+
+    def key(self) -> Tuple:
+        # Everything the aggregated cost depends on, for FitnessCache
+        return (self.x0.tobytes(), self.x0.shape, self.ref.tobytes(), self.disturbance.tobytes(), self.disturbance.shape,
+                self.aggregation, self.alpha)
+
+    def aggregate(self, costs: npt.NDArray[np.floating]) -> npt.NDArray[np.floating]:
+        # costs of shape PxS, one aggregated cost per individual
+        if self.aggregation == 'mean':
+            return np.mean(costs, axis=1)
+        if self.aggregation == 'worst':
+            return np.max(costs, axis=1)
+
+        tail = max(1, int(np.ceil(self.alpha * costs.shape[1])))
+        return np.mean(-np.partition(-costs, tail - 1, axis=1)[:, :tail], axis=1)
+
+
+class FitnessCache:
+    def __init__(self, maxsize: int = 10000, tol: float = 1e-6):
+        """
+        A bounded least recently used cache of rollout costs, so chromosomes seen before are not simulated again.
+
+        Parameters
+        ----------
+        maxsize: int
+        Number of costs kept, the least recently used one is evicted first
+
+        tol: float
+        Gains are rounded to multiples of tol for the key, gains closer than that share a cost
+        """
+        self.maxsize = maxsize
+        self.tol = tol
+
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, pid_gains: List[float], x0: List[float], y_idx: int, ref: float, scenarios: Optional['ScenarioSet'] = None) -> Tuple:
+        # With scenarios the cost does not depend on x0 and ref but on the scenario set
+        condition = (tuple(x0), ref) if scenarios is None else scenarios.key()
+        return tuple(int(round(gain / self.tol)) for gain in pid_gains), condition, y_idx
+
+    def keys(self, pop: npt.NDArray[np.floating], x0: List[float], y_idx: int, ref: float,
+             scenarios: Optional['ScenarioSet'] = None) -> List[Tuple]:
+        # key of every row of pop, rounded in one go
+        condition = (tuple(x0), ref) if scenarios is None else scenarios.key()
+        rounded = np.rint(np.asarray(pop, dtype=float) / self.tol).astype(np.int64).tolist()
+        return [(tuple(gains), condition, y_idx) for gains in rounded]
+
+    def get(self, key: Tuple) -> Optional[float]:
+        cost = self.entries.get(key)
+        if cost is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return cost
+
+    def put(self, key: Tuple, cost: float):
+        self.entries[key] = cost
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
 
-        return x + self.dt * (k1 + 2 * k2 + 2 * k3 + k4) / 6
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,69 @@
+"""
+Sinks for the per generation records of GeneticAlgorithm and checkpoints to resume a run from.
+
+    with JSONLSink('run.jsonl') as sink:
+        GeneticAlgorithm(..., callbacks=[sink], checkpoint_path='run.ckpt').run()
+"""
+import os
+import csv
+import json
+import math
+import pickle
+from typing import Dict, Optional
+
+# Keys of a generation record, in CSV column order
+FIELDS = ['generation', 'best', 'mean', 'diversity', 'evaluations', 'eval_seconds', 'seconds']
+
+
+class JSONLSink:
+    def __init__(self, path: str):
+        """
+        Appends every record as a JSON line, flushed per generation so a running job can be followed
+        with tail -f and a killed one keeps everything up to its last generation.
+        """
+        self.path = path
+        self.fp = open(path, 'a')
+
+    def __call__(self, record: Dict):
+        # JSON has no NaN or infinity, a fitness of inf is written as null
+        record = {key: None if isinstance(value, float) and not math.isfinite(value) else value for key, value in record.items()}
+        self.fp.write(json.dumps(record, allow_nan=False) + '\n')
+        self.fp.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.fp.close()
+
+
+class CSVSink(JSONLSink):
+    def __init__(self, path: str):
+        # Appends to an existing file, the header is only written to a new one
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        super().__init__(path)
+        self.writer = csv.DictWriter(self.fp, fieldnames=FIELDS, extrasaction='ignore')
+        if new:
+            self.writer.writeheader()
+
+    def __call__(self, record: Dict):
+        self.writer.writerow(record)
+        self.fp.flush()
+
+
+def save_checkpoint(path: str, state: Dict):
+    # Written next to the old checkpoint and renamed over it, so a run killed mid-write keeps the previous one
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as fp:
+        pickle.dump(state, fp, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: str) -> Optional[Dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as fp:
+        return pickle.load(fp)
@@ -0,0 +1,164 @@
+"""
+Perft, minimax, memory and position cache measurements over a fixed set of FEN positions
+(POSITIONS), for one board backend per run.
+
+    python benchmark.py --perft-depth 3 --search-depth 4 --backend bitboard --output bench.json
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from typing import List, Dict
+
+from main import new_board, perft, minimax, search, find_move, SearchClock, SearchStats, MoveOrdering, PositionCache, BOARD_BACKENDS, MOVE_BUFFERS
+
+# This ruleset has no castling, en passant or promotion, so the node counts are only
+# comparable with earlier runs of this benchmark. perft counts legal moves.
+# The start position has the king on d1 and the queen on e1, as Board() lays it out.
+POSITIONS = {
+    'start': 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBKQBNR w - - 0 1',
+    'kiwipete': 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w - - 0 1',
+    'endgame': '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+    'tactical': 'r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b - - 0 1',
+    'middlegame': 'r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP2BPPP/R2QKB1R w - - 0 1'
+}
+
+
+def bench_perft(backend: str, depth: int) -> List[Dict]:
+    results = []
+    for name, fen in POSITIONS.items():
+        board = BOARD_BACKENDS[backend].from_fen(fen)
+        for d in range(1, depth + 1):
+            start_time = time.perf_counter()
+            nodes = perft(board, d, board.side_to_move)
+            seconds = time.perf_counter() - start_time
+
+            results.append({
+                'position': name,
+                'fen': fen,
+                'depth': d,
+                'nodes': nodes,
+                'seconds': seconds,
+                'nodes_per_second': nodes / seconds if seconds else None
+            })
+
+    return results
+
+
+def bench_minimax(backend: str, depth: int) -> List[Dict]:
+    # Every position is searched with the hard-coded move scores and with the ordering heuristics,
+    # the node counts show what the heuristics prune
+    results = []
+    for name, fen in POSITIONS.items():
+        for ordering_name, ordering in [('static', MoveOrdering(heuristics=False)), ('heuristics', MoveOrdering())]:
+            board = BOARD_BACKENDS[backend].from_fen(fen)
+
+            clock = SearchClock()
+            score, piece, move = minimax(board, depth, board.side_to_move == 'w', -float('inf'), float('inf'), clock=clock, ordering=ordering)
+            time_ms = clock.elapsed_ms()
+
+            # Searched again with stats, the timers slow the search so they are kept out of time_ms
+            stats = SearchStats()
+            minimax(board, depth, board.side_to_move == 'w', -float('inf'), float('inf'), ordering=MoveOrdering(ordering.heuristics), stats=stats)
+
+            results.append({
+                'position': name,
+                'fen': fen,
+                'depth': depth,
+                'ordering': ordering_name,
+                'score': score,
+                'move': [move.start_pos, move.end_pos] if move else None,
+                'nodes': clock.nodes,
+                'quiescence_nodes': clock.qnodes,
+                'cutoffs': clock.cutoffs,
+                'time_ms': time_ms,
+                'nodes_per_second': clock.nodes / time_ms * 1000 if time_ms else None,
+                'stats': stats.summary()
+            })
+
+    return results
+
+
+def bench_memory(backend: str, depth: int) -> Dict:
+    # Peak traced allocation of a fixed depth search divided by its nodes, and the size of the objects involved
+    nodes, peak_bytes = 0, 0
+    for fen in POSITIONS.values():
+        board = BOARD_BACKENDS[backend].from_fen(fen)
+        clock = SearchClock()
+
+        tracemalloc.start()
+        minimax(board, depth, board.side_to_move == 'w', -float('inf'), float('inf'), clock=clock)
+        peak_bytes += tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        nodes += clock.nodes
+
+    board = new_board(backend)
+    code = board.generate_moves('w', MOVE_BUFFERS[0])[0]
+    return {
+        'depth': depth,
+        'nodes': nodes,
+        'peak_bytes': peak_bytes,
+        'peak_bytes_per_node': peak_bytes / nodes,
+        'packed_move_bytes': sys.getsizeof(code),
+        'move_object_bytes': sys.getsizeof(find_move(board, code)),
+        'piece_bytes': sys.getsizeof(board.pieces[0])
+    }
+
+
+def bench_cache(backend: str, depth: int, plies: int = 8) -> Dict:
+    # The opening of one game is played twice against the same cache file, empty the first time
+    # and reopened from disk the second time, the move latencies compare a cold and a warm cache
+    latencies = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = f"{tmpdir}/positions.bin"
+        for run_name in ['cold', 'warm']:
+            with PositionCache(path, min_depth=depth, book_plies=plies) as cache:
+                board = new_board(backend)
+                times_ms = []
+                for ply in range(plies):
+                    start_time = time.perf_counter()
+                    result = search(board, float('inf'), depth, ply % 2 == 0, cache=cache)
+                    times_ms.append((time.perf_counter() - start_time) * 1000)
+                    if not result.move:
+                        break
+                    board.make_move(result.move)
+
+                latencies[run_name] = {'moves': len(times_ms), 'mean_ms': sum(times_ms) / len(times_ms), 'times_ms': times_ms,
+                                       'hits': cache.hits, 'misses': cache.misses}
+
+    return {'depth': depth, 'plies': plies, **latencies}
+
+
+def run(backend: str = 'bitboard', perft_depth: int = 3, search_depth: int = 4) -> Dict:
+    return {
+        'backend': backend,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'perft': bench_perft(backend, perft_depth),
+        'minimax': bench_minimax(backend, search_depth),
+        'memory': bench_memory(backend, search_depth),
+        'cache': bench_cache(backend, search_depth)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Perft and minimax throughput benchmark")
+    parser.add_argument('--backend', default='bitboard', choices=list(BOARD_BACKENDS))
+    parser.add_argument('--perft-depth', type=int, default=3)
+    parser.add_argument('--search-depth', type=int, default=4)
+    parser.add_argument('--output', default=None, help="JSON file to write, stdout if not given")
+    args = parser.parse_args()
+
+    results = run(args.backend, args.perft_depth, args.search_depth)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,160 @@
+import os
+import mmap
+import struct
+from typing import Optional, Tuple
+
+# magic, format version, number of slots, store counter
+HEADER = struct.Struct('<8sIIQ')
+MAGIC = b'CHESSBK1'
+VERSION = 1
+
+# check (8 bytes) + score (8) + best move (2) + depth (1) + padding (1) + last use (4)
+SLOT = struct.Struct('<QdHBxI')
+ENTRY_BYTES = SLOT.size
+
+# Slots a key may occupy, the least recently used one is evicted when all are taken
+BUCKET = 4
+
+CacheEntry = Tuple[int, float, int]
+
+
+def _payload(score: float, move: int, depth: int) -> int:
+    # The 64-bit check stores key ^ payload, so an entry torn by a concurrent writer fails the key comparison
+    data = int.from_bytes(struct.pack('<dHB', score, move, depth), 'little')
+    return (data ^ data >> 64) & 0xFFFFFFFFFFFFFFFF
+
+
+class PositionCache:
+    def __init__(self, path: str, size_mb: float = 4, min_depth: int = 4, book_plies: int = 12, endgame_pieces: int = 8):
+        """
+        Best moves and scores of completed searches, kept in a memory-mapped file so they
+        survive between games and processes. It acts as an opening book for the first
+        plies of a game and as an endgame cache for positions with few pieces left.
+
+        Parameters
+        ----------
+        path:           File backing the cache, created if missing
+        size_mb:        Size bound of the file in megabytes, only used when it is created
+        min_depth:      A cached result is used when it was searched at least this deep,
+                        or at least as deep as the search asking for it
+        book_plies:     Positions within this many plies of the start of a game are cached
+        endgame_pieces: Positions with at most this many pieces are cached
+
+        Replacement policy
+        ------------------
+        A key maps to a bucket of 4 slots. The same position is overwritten by a search
+        that is not shallower, otherwise an empty slot is used or the least recently used
+        slot of the bucket is evicted.
+        """
+        self.path = path
+        self.min_depth = min_depth
+        self.book_plies = book_plies
+        self.endgame_pieces = endgame_pieces
+
+        if not os.path.exists(path) or os.path.getsize(path) < HEADER.size:
+            self._create(path, max(BUCKET, int(size_mb * 2**20) // ENTRY_BYTES // BUCKET * BUCKET))
+
+        self.fp = open(path, 'r+b')
+        self.mm = mmap.mmap(self.fp.fileno(), 0)
+
+        magic, version, self.size, self.tick = HEADER.unpack_from(self.mm, 0)
+        assert magic == MAGIC and version == VERSION, f"{path} is not a position cache of version {VERSION}"
+        assert len(self.mm) == HEADER.size + self.size * ENTRY_BYTES, f"{path} is truncated"
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.stores: int = 0
+        self.evictions: int = 0
+
+    @staticmethod
+    def _create(path: str, size: int):
+        # Processes sharing a path may create it at the same time. The file is written in full under a
+        # temporary name and hard linked into place, which fails if another process got there first,
+        # so a path never holds a partial file and a mapped file is never truncated
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as fp:
+            fp.write(HEADER.pack(MAGIC, VERSION, size, 0))
+            fp.truncate(HEADER.size + size * ENTRY_BYTES)
+        try:
+            if os.path.exists(path):
+                # Shorter than a header, no cache could have mapped it
+                os.replace(tmp_path, path)
+            else:
+                os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.mm.closed:
+            return
+        HEADER.pack_into(self.mm, 0, MAGIC, VERSION, self.size, self.tick)
+        self.mm.flush()
+        self.mm.close()
+        self.fp.close()
+
+    def wants(self, ply: int, pieces: int) -> bool:
+        # Only the opening and the endgame repeat across games
+        return ply < self.book_plies or pieces <= self.endgame_pieces
+
+    def _offset(self, idx: int) -> int:
+        return HEADER.size + idx * ENTRY_BYTES
+
+    def probe(self, key: int) -> Optional[CacheEntry]:
+        bucket = key % (self.size // BUCKET) * BUCKET
+        for idx in range(bucket, bucket + BUCKET):
+            offset = self._offset(idx)
+            check, score, move, depth, _ = SLOT.unpack_from(self.mm, offset)
+            if depth and check ^ _payload(score, move, depth) == key:
+                self.tick = (self.tick + 1) & 0xFFFFFFFF
+                SLOT.pack_into(self.mm, offset, check, score, move, depth, self.tick)
+                self.hits += 1
+                return depth, score, move
+
+        self.misses += 1
+        return None
+
+    def store(self, key: int, depth: int, score: float, move: int):
+        bucket = key % (self.size // BUCKET) * BUCKET
+        victim, oldest = None, None
+        for idx in range(bucket, bucket + BUCKET):
+            check, old_score, old_move, old_depth, last_use = SLOT.unpack_from(self.mm, self._offset(idx))
+            if not old_depth:
+                if victim is None or oldest >= 0:
+                    victim, oldest = idx, -1
+                continue
+            if check ^ _payload(old_score, old_move, old_depth) == key:
+                if old_depth > depth:
+                    return
+                victim, oldest = idx, -1
+                break
+            if oldest is None or 0 <= last_use < oldest:
+                victim, oldest = idx, last_use
+
+        if oldest >= 0:
+            self.evictions += 1
+
+        self.tick = (self.tick + 1) & 0xFFFFFFFF
+        SLOT.pack_into(self.mm, self._offset(victim), key ^ _payload(score, move, depth), score, move, depth, self.tick)
+        self.stores += 1
+
+    def stats(self) -> dict:
+        probes = self.hits + self.misses
+        return {
+            'path': self.path,
+            'size': self.size,
+            'size_mb': self.size * ENTRY_BYTES / 2**20,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / probes if probes else 0.0
+        }
@@ -1,13 +1,28 @@
 import time
 import copy
+import math
 import itertools
 import os, random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from IPython.display import display, HTML, clear_output
 from typing import Optional, Tuple, List, AnyStr, Union
 
+from transposition import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND
+from book import PositionCache
+from stats import SearchStats
+
 Position = Tuple[int, int]
+# (moved piece, start position, captured piece, its index in Board.pieces, game_over before the move)
+Undo = Tuple['Piece', Position, Optional['Piece'], Optional[int], bool]
+
+# Cell number -> position, shared tuples so decoding a move allocates nothing
+SQUARE_POSITIONS: List[Position] = [divmod(sq, 8) for sq in range(64)]
 
 class Piece:
+    __slots__ = ('name', 'pos', 'color', 'symbol', 'available_moves')
+
     def __init__(self, name: AnyStr, pos: Position, color: AnyStr, symbol: AnyStr):
         __acc_names = ['king', 'queen', 'rook', 'bishop', 'knight', 'pawn']
         __acc_colors = ['b', 'w']
@@ -21,9 +36,7 @@ class Piece:
         self.color: AnyStr = color
         self.symbol: AnyStr = symbol
 
-        self.available_moves: List[Position] = []
-
-        self.move_factory = MoveFactory() 
+        self.available_moves: List[Move] = []
 
     def __repr__(self):
         return f"Piece {self.name} in team {self.color} with pos {self.pos}"
@@ -36,26 +49,9 @@ class Piece:
 
         assert  0 <= end_pos[0] < 8, f"Wrong move provided {self} to {end_pos}"
         assert  0 <= end_pos[1] < 8, f"Wrong move provided {self} to {end_pos}"
+        assert move.start_pos == self.pos, f"Wrong move provided {self} from {move.start_pos}"
 
-        # Starting position set to empty
-        x_st, y_st = self.pos
-        board.board[x_st][y_st] = "\u2022"
-
-        # Check if the resulting position is occupied by another piece
-        # Set the other piece to empty
-        unknown_piece = self.find_by_pos(end_pos, board)
-        if unknown_piece:
-            if unknown_piece.name == "king":
-                board.game_over = True
-
-            board.captured_pieces.append(unknown_piece)
-            board.pieces.remove(unknown_piece)
-
-            x, y = end_pos
-            self.pos = (x, y)
-        else:
-            x, y = end_pos
-            self.pos = (x, y)
+        return board.make_move(move)
 
     def can_move(self, pos: Position, state: List[Position]):
         can_move = False
@@ -66,12 +62,7 @@ class Piece:
         return can_move
 
     def find_by_pos(self, pos, board):
-        # REMINDME: Make it static or a Board method (prob)
-        for piece in board.pieces:
-            if piece.pos == pos:
-                return piece
-
-        return False
+        return board.piece_at(pos)
 
     def _check_position_bounds(self, pos: Position) -> Union[Position, None]:
         in_bounds = pos
@@ -81,214 +72,63 @@ class Piece:
         return in_bounds
 
     def calculate_moves(self, board):
-        self.available_moves: List[Position] = []
+        codes = []
+        self.generate_moves(board, codes)
+        self.available_moves = [find_move(board, code) for code in codes]
 
-        white_pieces = [piece.pos for piece in board.pieces if piece.color == 'w']
-        black_pieces = [piece.pos for piece in board.pieces if piece.color == 'b']
+        return self.available_moves
 
-        map = board.board
-        curr_player = self.color
+    def generate_moves(self, board, moves: List[int]):
+        # Appends the packed moves of the piece (see pack_move) to moves
+        start_pos = self.pos
+        sq = start_pos[0]*8 + start_pos[1]
+        capture_code, quiet_code = MOVE_CODES[self.name]
+        capture_code |= sq << 6
+        quiet_code |= sq << 6
 
         match self.name:
-            case "king":
-                start_pos = self.pos
-                # directions=[forward, backward, left, right, forward diagonal right, forward diagonal left, backward diagonal right, backward diagonal left]
-                directions = [(1, 0), (-1, 0), (0, -1), (0, 1), (1, 1), (1, -1), (-1, 1), (-1, -1)]
-                for dir in directions:
-                    end_pos = self._check_position_bounds((start_pos[0] + dir[0], start_pos[1] + dir[1]))
-
-                    if not end_pos:
-                        continue
-
-                    unknown_piece = self.find_by_pos(end_pos, board)
+            case "king" | "knight":
+                for end_pos in LEAPER_TARGETS[self.name][sq]:
+                    unknown_piece = board.piece_at(end_pos)
                     # There are 3 states a board cell can be in.
                     # 1. empty  2. Occupied by same team    3. Occupied by enemy team
-                    if end_pos and unknown_piece and self.color != unknown_piece.color:
-                        # Cell is occupied by enemy team, capture is registered as a valid move
-                        self.available_moves.append(
-                            self.move_factory(piece=self, start_pos=start_pos, end_pos=end_pos, score=10000.0, is_capture=True, captured_piece=unknown_piece)
-                        )
-
-                    elif not unknown_piece:
+                    if not unknown_piece:
                         # Cell is unoccupied, move
-                        self.available_moves.append(
-                            self.move_factory(piece=self, start_pos=start_pos, end_pos=end_pos, score=1000.0, is_capture=False, captured_piece=None)
-                        )
-                    if end_pos and unknown_piece and self.color == unknown_piece.color:
-                        # Cell occupied by same team, check next move
-                        continue
-
-            case "queen":
-                start_pos = self.pos
-
-                # directions=[forward, backward, left, right, left_forward, right_forward, left_backward, right_backward]
-                directions = [(1, 0), (-1, 0), (0, -1), (0, 1), (1, -1), (1, 1), (-1, -1), (-1, 1)]
-                for dir in directions:
-                    for i in range(8):
-                        end_pos = self._check_position_bounds((start_pos[0] + i*dir[0], start_pos[1] + i*dir[1]))
-
-                        if not end_pos:
-                            continue
-
-                        unknown_piece = self.find_by_pos(end_pos, board)
-                        # There are 3 states a board cell can be in.
-                        # 1. empty  2. Occupied by same team    3. Occupied by enemy team
-                        if end_pos and unknown_piece and self.color != unknown_piece.color:
-                            # Cell is occupied by enemy team, capture is registered as a valid move
-                            self.available_moves.append(
-                                self.move_factory(piece=self, start_pos=start_pos, end_pos=end_pos, score=600.0, is_capture=True, captured_piece=unknown_piece)
-                            )
-                            break
-
-                        elif not unknown_piece:
-                            # Cell is unoccupied, move
-                            self.available_moves.append(
-                                self.move_factory(piece=self, start_pos=start_pos, end_pos=end_pos, score=300.0, is_capture=False, captured_piece=None)
-                            )
-                        if end_pos and unknown_piece and self.color == unknown_piece.color:
-                            # Cell occupied by same team, check next move
-                            break
-
-
-            case "rook":
-                start_pos = self.pos
-
-                # directions=[forward, backward, left, right]
-                directions = [(1, 0), (-1, 0), (0, -1), (0, 1)]
-                for dir in directions:
-                    for i in range(8):
-                        end_pos = self._check_position_bounds((start_pos[0] + i*dir[0], start_pos[1] + i*dir[1]))
-
-                        if not end_pos:
-                            continue
-
-                        unknown_piece = self.find_by_pos(end_pos, board)
-                        # There are 3 states a board cell can be in.
-                        # 1. empty  2. Occupied by same team    3. Occupied by enemy team
-                        if end_pos and unknown_piece and self.color != unknown_piece.color:
-                            # Cell is occupied by enemy team, capture is registered as a valid move
-                            self.available_moves.append(
-                                self.move_factory(piece=self, start_pos=start_pos, end_pos=end_pos, score=200.0, is_capture=True, captured_piece=unknown_piece)
-                            )
-                            break
-
-                        elif not unknown_piece:
-                            # Cell is unoccupied, move
-                            self.available_moves.append(
-                                self.move_factory(piece=self, start_pos=start_pos, end_pos=end_pos, score=100.0, is_capture=False, captured_piece=None)
-                            )
-
-                        if end_pos and unknown_piece and self.color == unknown_piece.color:
-                            # Cell occupied by same team, check next move
-                            break
-
-            case "bishop":
-                start_pos = self.pos
-
-                # directions=[left_forward, right_forward, left_backward, right_backward]
-                directions = [(1, -1), (1, 1), (-1, -1), (-1, 1)]
-                for dir in directions:
-                    for i in range(8):
-                        end_pos = self._check_position_bounds((start_pos[0] + i*dir[0], start_pos[1] + i*dir[1]))
-
-                        if not end_pos:
+                        moves.append(quiet_code | end_pos[0]*8 + end_pos[1])
+                    elif self.color != unknown_piece.color:
+                        # Cell is occupied by enemy team, capture is registered as a valid move
+                        moves.append(capture_code | PIECE_TYPES[unknown_piece.name] << 15 | end_pos[0]*8 + end_pos[1])
+
+            case "queen" | "rook" | "bishop":
+                for ray in SLIDER_RAYS[self.name][sq]:
+                    for end_pos in ray:
+                        unknown_piece = board.piece_at(end_pos)
+                        if not unknown_piece:
+                            # Cell is unoccupied, move and keep sliding
+                            moves.append(quiet_code | end_pos[0]*8 + end_pos[1])
                             continue
 
-                        unknown_piece = self.find_by_pos(end_pos, board)
-                        # There are 3 states a board cell can be in.
-                        # 1. empty  2. Occupied by same team    3. Occupied by enemy team
-                        if end_pos and unknown_piece and self.color != unknown_piece.color:
+                        if self.color != unknown_piece.color:
                             # Cell is occupied by enemy team, capture is registered as a valid move
-                            self.available_moves.append(
-                                self.move_factory(piece=self, start_pos=start_pos, end_pos=end_pos, score=100.0, is_capture=True, captured_piece=unknown_piece)
-                            )
-                            break
-
-                        elif not unknown_piece:
-                            # Cell is unoccupied, move
-                            self.available_moves.append(
-                                self.move_factory(piece=self, start_pos=start_pos, end_pos=end_pos, score=50.0, is_capture=False, captured_piece=None)
-                            )
-
-                        if end_pos and unknown_piece and self.color == unknown_piece.color:
-                            # Cell occupied by same team, check next move
-                            break
-
-            case "knight":
-                start_pos = self.pos
-
-                directions = [(1, 2), (1, -2), (-1, 2), (-1, -2), (2, 1), (2, -1), (-2, 1), (-2, -1)]
-                for dir in directions:
-                    end_pos = self._check_position_bounds((start_pos[0] + dir[0], start_pos[1] + dir[1]))
-
-                    if not end_pos:
-                        continue
-
-                    unknown_piece = self.find_by_pos(end_pos, board)
-                    # There are 3 states a board cell can be in.
-                    # 1. empty  2. Occupied by same team    3. Occupied by enemy team
-                    if end_pos and unknown_piece and self.color != unknown_piece.color:
-                        # Cell is occupied by enemy team, capture is registered as a valid move
-                        self.available_moves.append(
-                            self.move_factory(piece=self, start_pos=start_pos, end_pos=end_pos, score=100.0, is_capture=True, captured_piece=unknown_piece)
-                        )
-
-                    elif not unknown_piece:
-                        # Cell is unoccupied, move
-                        self.available_moves.append(
-                            self.move_factory(piece=self, start_pos=start_pos, end_pos=end_pos, score=0.0, is_capture=False, captured_piece=None)
-                        )
-
-                    if end_pos and unknown_piece and self.color == unknown_piece.color:
-                        # Cell occupied by same team, check next move
-                        continue
+                            moves.append(capture_code | PIECE_TYPES[unknown_piece.name] << 15 | end_pos[0]*8 + end_pos[1])
+                        # Any piece blocks the rest of the ray
+                        break
 
             case "pawn":
-                start_pos = self.pos
-                home_pos = 2 if start_pos[0] == 1 or start_pos[0] == 6 else 1
-                pawn_dir = 1 if curr_player == 'w' else -1
-
-                #directions=[forward, forward_right, forward_left]
-                directions = [(pawn_dir*home_pos, 0), (pawn_dir, 1), (pawn_dir, -1)]
-                for dir in directions:
-                    end_pos = self._check_position_bounds((start_pos[0] + dir[0], start_pos[1] + dir[1]))
-
-                    if not end_pos:
-                        continue
+                # REMINDME: Put condition for reaching final rank and promoting to queen
 
-                    # REMINDME: Put condition for reaching final rank and promoting to queen
+                # forward, a pawn can only move into empty cells and the +2 needs the +1 to be free
+                for end_pos in PAWN_PUSH_TARGETS[self.color][sq]:
+                    if board.piece_at(end_pos):
+                        break
+                    moves.append(quiet_code | end_pos[0]*8 + end_pos[1])
 
-                    unknown_piece = self.find_by_pos(end_pos, board)
-                    # There are 3 states a board cell can be in.
-                    # 1. empty  2. Occupied by same team    3. Occupied by enemy team
-                    if end_pos and unknown_piece and self.color != unknown_piece.color and dir != (pawn_dir*home_pos, 0):
+                # forward_right, forward_left, a pawn can only move diagonally when capturing
+                for end_pos in PAWN_CAPTURE_TARGETS[self.color][sq]:
+                    unknown_piece = board.piece_at(end_pos)
+                    if unknown_piece and self.color != unknown_piece.color:
                         # Cell is occupied by enemy team, capture is registered as a valid move
-                        self.available_moves.append(
-                            self.move_factory(piece=self, start_pos=start_pos, end_pos=end_pos, score=20.0, is_capture=True, captured_piece=unknown_piece)
-                        )
-
-                    elif not unknown_piece and dir == (pawn_dir*home_pos, 0):
-                        # Since the first move examined is the +2 forward
-                        # We need to also examing the +1 forward if there is any pawn and not hover above it
-                        inter_piece = self.find_by_pos((end_pos[0]-pawn_dir, end_pos[1]), board)
-                        if inter_piece:
-                            break
-                        else:
-                            # Cell is unoccupied, move
-                            self.available_moves.append(
-                                self.move_factory(piece=self, start_pos=start_pos, end_pos=end_pos, score=0.0, is_capture=False, captured_piece=None)
-                            )
-                        if home_pos == 2:
-                            if not inter_piece:
-                                self.available_moves.append(
-                                    self.move_factory(piece=self, start_pos=start_pos, end_pos=(end_pos[0]-pawn_dir, end_pos[1]), score=0.0, is_capture=False, captured_piece=None)
-                                )
-
-                    if end_pos and unknown_piece and self.color == unknown_piece.color:
-                        # Cell occupied by same team, check next move
-                        break
-        
-        return list(set(self.available_moves))
+                        moves.append(capture_code | PIECE_TYPES[unknown_piece.name] << 15 | end_pos[0]*8 + end_pos[1])
 
 class PieceFactory:
     def __call__(self, name: AnyStr, pos: Position, color: AnyStr, symbol: AnyStr):
@@ -297,6 +137,8 @@ class PieceFactory:
         return self.piece
 
 class Move:
+    __slots__ = ('piece', 'start_pos', 'end_pos', 'score', 'is_capture', 'captured_piece')
+
     def __init__(self, piece: Piece, start_pos: Position, end_pos: Position, score: float, is_capture: bool, captured_piece: Piece=None):
         self.piece = piece
         self.start_pos = start_pos
@@ -315,8 +157,31 @@ class MoveFactory:
 
         return self.move
 
+# A single factory shared by all pieces, it keeps no per piece state
+Piece.move_factory = MoveFactory()
+
+# Placement strings list the 64 cells in square order, white pieces upper case, empty cells as '.'
+PIECE_LETTERS = {'king': 'k', 'queen': 'q', 'rook': 'r', 'bishop': 'b', 'knight': 'n', 'pawn': 'p'}
+LETTER_PIECES = {letter: name for name, letter in PIECE_LETTERS.items()}
+
+def square_name(pos: Position) -> str:
+    # Row 0 is rank 1 and column 0 is file a
+    return 'abcdefgh'[pos[1]] + str(pos[0] + 1)
+
+def placement_from_fen(fen: str) -> str:
+    # FEN ranks run from 8 down to 1, rank 1 is row 0 and file a is column 0
+    ranks = fen.split()[0].split('/')
+    assert len(ranks) == 8, f"A FEN has 8 ranks, you provided {len(ranks)}"
+
+    cells = []
+    for rank in reversed(ranks):
+        for letter in rank:
+            cells.extend('.' * int(letter) if letter.isdigit() else letter)
+
+    return ''.join(cells)
+
 class Board:
-    def __init__(self):
+    def __init__(self, placement: Optional[str] = None):
         __acc_names = ['king', 'queen', 'rook', 'bishop', 'knight', 'pawn']
         __piece_nums = [1, 1, 2, 2, 2, 8]
         __pieces_num_map = {p_name: p_num for p_name, p_num in zip(__acc_names, __piece_nums)}
@@ -346,8 +211,9 @@ class Board:
         self.captured_pieces: List[Piece] = []
 
         self.game_over: bool = False
+        self.side_to_move: AnyStr = 'w'
 
-        self.move_history: List[dict] = []
+        self.move_history: List[Undo] = []
 
         king_positions = [(0, 3), (7, 4)]
         queen_positions = [(0, 4), (7, 3)]
@@ -361,12 +227,23 @@ class Board:
         self.board = [['\u2022' for _ in range(8)] for _ in range(8)]
 
         # Generate pieces
-        for p_name, p_pos in list(__pieces_pos_map.items()):
-            for p_idx, piece_pos in enumerate(p_pos):
-                if p_idx < len(p_pos)//2:
-                    self.pieces.append(self.pawn_factory(name=p_name, pos=piece_pos, color="w", symbol=white_pieces[p_name]))
+        if placement is None:
+            for p_name, p_pos in list(__pieces_pos_map.items()):
+                for p_idx, piece_pos in enumerate(p_pos):
+                    if p_idx < len(p_pos)//2:
+                        self.pieces.append(self.pawn_factory(name=p_name, pos=piece_pos, color="w", symbol=white_pieces[p_name]))
+                    else:
+                        self.pieces.append(self.pawn_factory(name=p_name, pos=piece_pos, color="b", symbol=black_pieces[p_name]))
+        else:
+            assert len(placement) == 64, f"A placement has 64 cells, you provided {len(placement)}"
+            for sq, letter in enumerate(placement):
+                if letter == '.':
+                    continue
+                p_name = LETTER_PIECES[letter.lower()]
+                if letter.isupper():
+                    self.pieces.append(self.pawn_factory(name=p_name, pos=divmod(sq, 8), color="w", symbol=white_pieces[p_name]))
                 else:
-                    self.pieces.append(self.pawn_factory(name=p_name, pos=piece_pos, color="b", symbol=black_pieces[p_name]))
+                    self.pieces.append(self.pawn_factory(name=p_name, pos=divmod(sq, 8), color="b", symbol=black_pieces[p_name]))
 
         # Assign each piece to the board
         for piece in self.pieces:
@@ -375,6 +252,18 @@ class Board:
             if 0 <= x < 8 and 0 <= y < 8:
                 self.board[x][y] = piece.symbol
 
+        # Zobrist key and evaluation terms of the position, kept up to date by every piece mutation below
+        self.zobrist: int = 0
+        self.material = {'b': 0, 'w': 0}
+        self.positional = {'b': 0, 'w': 0}
+        self.empty_cells: int = 64 - len(self.pieces)
+        self.evaluate_mobility: bool = False
+        for piece in self.pieces:
+            sq = _square(piece.pos)
+            self.zobrist ^= ZOBRIST_KEYS[piece.color, piece.name][sq]
+            self.material[piece.color] += PIECE_VALUES[piece.name]
+            self.positional[piece.color] += PIECE_SQUARE_TABLES[piece.color, piece.name][sq]
+
     def show(self, player: str=None, score: float=None, time: float=None):
         # This is for colab, use self.clear() for terminal
         # clear_output(wait=True)
@@ -408,6 +297,197 @@ class Board:
     def get_pieces_for_player(self, player: AnyStr):
         return [piece for piece in self.pieces if piece.color == player]
 
+    def piece_at(self, pos: Position) -> Optional[Piece]:
+        for piece in self.pieces:
+            if piece.pos == pos:
+                return piece
+
+        return None
+
+    def piece_moves(self, piece: Piece) -> List[Move]:
+        return piece.calculate_moves(self)
+
+    def generate_moves(self, player: AnyStr, moves: List[int]) -> List[int]:
+        # Fills moves with the packed moves of the player, the list is reused by the search
+        moves.clear()
+        for piece in self.pieces:
+            if piece.color == player:
+                piece.generate_moves(self, moves)
+
+        return moves
+
+    def generate_captures(self, player: AnyStr, moves: List[int]) -> List[int]:
+        self.generate_moves(player, moves)
+        moves[:] = [code for code in moves if code >> 15 & 7]
+
+        return moves
+
+    def generate_legal_moves(self, player: AnyStr, moves: List[int]) -> List[int]:
+        # Same as generate_moves without the moves leaving the king of the player attacked
+        return self._legal(player, self.generate_moves(player, moves))
+
+    def generate_legal_captures(self, player: AnyStr, moves: List[int]) -> List[int]:
+        return self._legal(player, self.generate_captures(player, moves))
+
+    def _legal(self, player: AnyStr, moves: List[int]) -> List[int]:
+        # Reference implementation, every move is played and the king tested, BitBoard uses pins and checkers instead
+        legal = []
+        for code in moves:
+            undo = self.make_packed(code)
+            if not self.in_check(player):
+                legal.append(code)
+            self.unmake_move(undo)
+        moves[:] = legal
+
+        return moves
+
+    def find_king(self, player: AnyStr) -> Optional[Piece]:
+        for piece in self.pieces:
+            if piece.name == "king" and piece.color == player:
+                return piece
+
+        return None
+
+    def is_attacked(self, pos: Position, color: AnyStr) -> bool:
+        # Looks outwards from the cell for a piece of color able to reach it
+        sq = _square(pos)
+        for name in ["knight", "king"]:
+            for from_pos in LEAPER_TARGETS[name][sq]:
+                piece = self.piece_at(from_pos)
+                if piece and piece.color == color and piece.name == name:
+                    return True
+
+        # A pawn of color attacks the cell from where a pawn of the other color on the cell would capture
+        for from_pos in PAWN_CAPTURE_TARGETS['b' if color == 'w' else 'w'][sq]:
+            piece = self.piece_at(from_pos)
+            if piece and piece.color == color and piece.name == "pawn":
+                return True
+
+        for direction in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+            sliders = ["queen", "rook"] if direction in ROOK_DIRECTIONS else ["queen", "bishop"]
+            for from_pos in RAYS[direction][sq]:
+                piece = self.piece_at(from_pos)
+                if piece:
+                    if piece.color == color and piece.name in sliders:
+                        return True
+                    break
+
+        return False
+
+    def in_check(self, player: AnyStr) -> bool:
+        king = self.find_king(player)
+
+        return king is not None and self.is_attacked(king.pos, 'b' if player == 'w' else 'w')
+
+    def attacked_squares(self, color: AnyStr) -> int:
+        # Bitboard of the cells attacked by color, pawns attack their capture cells only
+        attacked = 0
+        for piece in self.get_pieces_for_player(color):
+            sq = _square(piece.pos)
+            match piece.name:
+                case "king" | "knight":
+                    attacked |= _mask(LEAPER_TARGETS[piece.name][sq])
+                case "pawn":
+                    attacked |= _mask(PAWN_CAPTURE_TARGETS[color][sq])
+                case _:
+                    for ray in SLIDER_RAYS[piece.name][sq]:
+                        for end_pos in ray:
+                            attacked |= 1 << _square(end_pos)
+                            if self.piece_at(end_pos):
+                                break
+
+        return attacked
+
+    def status(self, player: AnyStr) -> Optional[str]:
+        # 'checkmate' or 'stalemate' when the player has no legal move, None while the game goes on
+        if self.generate_legal_moves(player, []):
+            return None
+
+        return "checkmate" if self.in_check(player) else "stalemate"
+
+    def remove_piece(self, piece: Piece):
+        # The captured piece is kept, its cell is taken over by the capturing piece
+        self.captured_pieces.append(piece)
+        self.pieces.remove(piece)
+
+        sq = _square(piece.pos)
+        self.zobrist ^= ZOBRIST_KEYS[piece.color, piece.name][sq]
+        self.material[piece.color] -= PIECE_VALUES[piece.name]
+        self.positional[piece.color] -= PIECE_SQUARE_TABLES[piece.color, piece.name][sq]
+        self.empty_cells += 1
+
+    def relocate_piece(self, piece: Piece, end_pos: Position):
+        x_st, y_st = piece.pos
+        self.board[x_st][y_st] = "\u2022"
+
+        x, y = end_pos
+        piece.pos = end_pos
+        self.board[x][y] = piece.symbol
+
+        keys = ZOBRIST_KEYS[piece.color, piece.name]
+        self.zobrist ^= keys[x_st*8 + y_st] ^ keys[x*8 + y]
+        table = PIECE_SQUARE_TABLES[piece.color, piece.name]
+        self.positional[piece.color] += table[x*8 + y] - table[x_st*8 + y_st]
+
+    def restore_piece(self, piece: Piece, index: int):
+        self.captured_pieces.pop()
+        self.pieces.insert(index, piece)
+
+        x, y = piece.pos
+        self.board[x][y] = piece.symbol
+
+        sq = _square(piece.pos)
+        self.zobrist ^= ZOBRIST_KEYS[piece.color, piece.name][sq]
+        self.material[piece.color] += PIECE_VALUES[piece.name]
+        self.positional[piece.color] += PIECE_SQUARE_TABLES[piece.color, piece.name][sq]
+        self.empty_cells -= 1
+
+    def make_move(self, move: Move) -> Undo:
+        """
+        Plays the move in place and returns what unmake_move needs to take it back.
+        """
+        return self._make(move.start_pos, move.end_pos)
+
+    def make_packed(self, code: int) -> Undo:
+        # Same as make_move for a move packed by pack_move
+        return self._make(SQUARE_POSITIONS[code >> 6 & 63], SQUARE_POSITIONS[code & 63])
+
+    def _make(self, start_pos: Position, end_pos: Position) -> Undo:
+        piece = self.piece_at(start_pos)
+        game_over = self.game_over
+
+        # Check if the resulting position is occupied by another piece
+        # Set the other piece to empty
+        unknown_piece = self.piece_at(end_pos)
+        captured_index = None
+        if unknown_piece:
+            if unknown_piece.name == "king":
+                self.game_over = True
+
+            captured_index = self.pieces.index(unknown_piece)
+            self.remove_piece(unknown_piece)
+
+        # Starting position set to empty, the piece is stamped on its new cell
+        self.relocate_piece(piece, end_pos)
+
+        self.side_to_move = 'b' if piece.color == 'w' else 'w'
+
+        undo = (piece, start_pos, unknown_piece, captured_index, game_over)
+        self.move_history.append(undo)
+
+        return undo
+
+    def unmake_move(self, undo: Undo):
+        piece, start_pos, captured_piece, captured_index, game_over = undo
+
+        self.move_history.pop()
+        self.side_to_move = piece.color
+        self.relocate_piece(piece, start_pos)
+        if captured_piece:
+            self.restore_piece(captured_piece, captured_index)
+
+        self.game_over = game_over
+
     def count_pieces(self, team: str):
         p_idx = 0
         for p in self.pieces:
@@ -416,46 +496,659 @@ class Board:
 
         return p_idx
 
+    def mobility(self, player: AnyStr) -> int:
+        return sum(len(self.piece_moves(piece)) for piece in self.get_pieces_for_player(player))
+
     def score_board(self, player: AnyStr):
+        """
+        Scores the position for the player from running totals kept by every piece mutation,
+        so it costs O(1) unless self.evaluate_mobility asks for the (move generating) mobility term.
+        """
         assert player in self.__acc_colors, f"Valid players are 'w' and 'b', you provided {player}"
 
-        PIECE_VALUES = {
-        "king": 1000,
-        "queen": 9,
-        "rook": 5,
-        "bishop": 3,
-        "knight": 3,
-        "pawn": 1
-    }
-        player_score = 0
-        opponent_score = 0
-        player_valid_moves = 0
-        opponent_valid_moves = 0
-
-        empty_cells  = 0
-        for i in range(8):
-            for j in range(8):
-                if self.board[i][j] == '\u2022':
-                    empty_cells += 1
+        opponent = 'b' if player == 'w' else 'w'
 
-        for piece in self.pieces:
-            value = PIECE_VALUES.get(piece.name, 0)
+        score = (self.material[player] - self.material[opponent]) + (self.empty_cells-32)
+        score += (self.positional[player] - self.positional[opponent]) / 100
 
-            if piece.color == player:
-                player_score += value
-                player_valid_moves += len(piece.calculate_moves(self))
-            else:
-                opponent_score += value
-                opponent_valid_moves += len(piece.calculate_moves(self))
+        if self.evaluate_mobility:
+            score += MOBILITY_WEIGHT * (self.mobility(player) - self.mobility(opponent))
 
-        return (player_score - opponent_score) + (empty_cells-32)
+        return score
 
     def clone(self):
         return copy.deepcopy(self)
 
+    def placement(self) -> str:
+        # The 64 cells as letters, see PIECE_LETTERS
+        cells = ['.'] * 64
+        for piece in self.pieces:
+            letter = PIECE_LETTERS[piece.name]
+            cells[_square(piece.pos)] = letter.upper() if piece.color == 'w' else letter
+
+        return ''.join(cells)
+
+    @classmethod
+    def from_fen(cls, fen: str):
+        # Castling, en passant and the move clocks are ignored, the ruleset has none of them
+        fields = fen.split()
+        board = cls(placement_from_fen(fen))
+        board.side_to_move = fields[1] if len(fields) > 1 else 'w'
+
+        return board
+
+    def to_fen(self) -> str:
+        placement = self.placement()
+
+        ranks = []
+        for x in range(7, -1, -1):
+            rank = ''
+            empty = 0
+            for letter in placement[x*8:x*8 + 8]:
+                if letter == '.':
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += letter
+            ranks.append(rank + (str(empty) if empty else ''))
+
+        return f"{'/'.join(ranks)} {self.side_to_move} - - 0 {len(self.move_history) // 2 + 1}"
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        assert len(data) == POSITION_BYTES, f"A position is {POSITION_BYTES} bytes, you provided {len(data)}"
+
+        cells = []
+        for byte in data[:32]:
+            cells.append(NIBBLE_LETTERS[byte >> 4])
+            cells.append(NIBBLE_LETTERS[byte & 15])
+
+        board = cls(''.join(cells))
+        board.side_to_move = 'b' if data[32] & 1 else 'w'
+        board.game_over = bool(data[32] & 2)
+
+        return board
+
+    def to_bytes(self) -> bytes:
+        """
+        Fixed-size binary encoding of the position, used for IPC, position caches and fixtures.
+        Cells are packed two per byte as 4-bit piece codes (see NIBBLE_LETTERS), the last byte
+        holds the side to move (bit 0) and game_over (bit 1).
+        """
+        data = bytearray(POSITION_BYTES)
+        for piece in self.pieces:
+            sq = _square(piece.pos)
+            nibble = PIECE_TYPES[piece.name] | (8 if piece.color == 'b' else 0)
+            data[sq >> 1] |= nibble << 4 if sq % 2 == 0 else nibble
+
+        data[32] = (self.side_to_move == 'b') | self.game_over << 1
+
+        return bytes(data)
+
     def clear(self):
         os.system('cls' if os.name == 'nt' else 'clear')
 
+# Cells are numbered x*8 + y, which is also the bit of the cell in a bitboard
+def _square(pos: Position) -> int:
+    return pos[0] * 8 + pos[1]
+
+def _mask(positions: List[Position]) -> int:
+    mask = 0
+    for pos in positions:
+        mask |= 1 << _square(pos)
+
+    return mask
+
+# Move tables, computed once per cell at import so move generation needs no bounds checks
+def _leaper_targets(offsets: List[Position]) -> List[List[Position]]:
+    targets = []
+    for sq in range(64):
+        x, y = divmod(sq, 8)
+        targets.append([(x + dx, y + dy) for dx, dy in offsets if 0 <= x + dx < 8 and 0 <= y + dy < 8])
+
+    return targets
+
+def _ray_targets(direction: Position) -> List[List[Position]]:
+    # Cells along the direction ordered outwards, the starting cell is not part of its ray
+    rays = []
+    for sq in range(64):
+        x, y = divmod(sq, 8)
+        ray = []
+        for i in range(1, 8):
+            if not (0 <= x + i*direction[0] < 8 and 0 <= y + i*direction[1] < 8):
+                break
+            ray.append((x + i*direction[0], y + i*direction[1]))
+        rays.append(ray)
+
+    return rays
+
+def _pawn_push_targets(color: AnyStr) -> List[List[Position]]:
+    # Ordered +1 then +2 forward, the +2 only from the home row
+    pawn_dir, home_row = (1, 1) if color == 'w' else (-1, 6)
+    targets = []
+    for sq in range(64):
+        x, y = divmod(sq, 8)
+        if not 0 <= x + pawn_dir < 8:
+            targets.append([])
+        elif x == home_row:
+            targets.append([(x + pawn_dir, y), (x + 2*pawn_dir, y)])
+        else:
+            targets.append([(x + pawn_dir, y)])
+
+    return targets
+
+ROOK_DIRECTIONS = [(1, 0), (-1, 0), (0, -1), (0, 1)]
+BISHOP_DIRECTIONS = [(1, -1), (1, 1), (-1, -1), (-1, 1)]
+SLIDER_DIRECTIONS = {'queen': ROOK_DIRECTIONS + BISHOP_DIRECTIONS, 'rook': ROOK_DIRECTIONS, 'bishop': BISHOP_DIRECTIONS}
+
+KNIGHT_TARGETS = _leaper_targets([(1, 2), (1, -2), (-1, 2), (-1, -2), (2, 1), (2, -1), (-2, 1), (-2, -1)])
+KING_TARGETS = _leaper_targets([(1, 0), (-1, 0), (0, -1), (0, 1), (1, 1), (1, -1), (-1, 1), (-1, -1)])
+LEAPER_TARGETS = {'king': KING_TARGETS, 'knight': KNIGHT_TARGETS}
+PAWN_CAPTURE_TARGETS = {'w': _leaper_targets([(1, 1), (1, -1)]), 'b': _leaper_targets([(-1, 1), (-1, -1)])}
+PAWN_PUSH_TARGETS = {'w': _pawn_push_targets('w'), 'b': _pawn_push_targets('b')}
+RAYS = {direction: _ray_targets(direction) for direction in ROOK_DIRECTIONS + BISHOP_DIRECTIONS}
+# The non empty rays of every slider from every cell
+SLIDER_RAYS = {
+    name: [[RAYS[direction][sq] for direction in directions if RAYS[direction][sq]] for sq in range(64)]
+    for name, directions in SLIDER_DIRECTIONS.items()
+}
+
+# The same tables as bitboards
+KNIGHT_MASKS = [_mask(targets) for targets in KNIGHT_TARGETS]
+KING_MASKS = [_mask(targets) for targets in KING_TARGETS]
+PAWN_CAPTURE_MASKS = {color: [_mask(targets) for targets in PAWN_CAPTURE_TARGETS[color]] for color in ['b', 'w']}
+# Directions with a positive square offset are blocked by their lowest set bit, the rest by their highest
+RAY_MASKS = {direction: [_mask(ray) for ray in rays] for direction, rays in RAYS.items()}
+
+def _nearest(direction: Position, blockers: int) -> int:
+    # Cell of the blocker closest to the start of a ray in direction
+    if direction[0] * 8 + direction[1] > 0:
+        return (blockers & -blockers).bit_length() - 1
+    return blockers.bit_length() - 1
+
+# Cells strictly between two cells on a common rank, file or diagonal, 0 when they are not aligned
+BETWEEN_MASKS: List[List[int]] = [[0] * 64 for _ in range(64)]
+for _direction, _rays in RAYS.items():
+    for _sq in range(64):
+        _between = 0
+        for _pos in _rays[_sq]:
+            BETWEEN_MASKS[_sq][_square(_pos)] = _between
+            _between |= 1 << _square(_pos)
+
+# (capture score, quiet score) used to order the moves of every piece
+MOVE_SCORES = {
+    'king': (10000.0, 1000.0),
+    'queen': (600.0, 300.0),
+    'rook': (200.0, 100.0),
+    'bishop': (100.0, 50.0),
+    'knight': (100.0, 0.0),
+    'pawn': (20.0, 0.0)
+}
+
+PIECE_VALUES = {
+    "king": 1000,
+    "queen": 9,
+    "rook": 5,
+    "bishop": 3,
+    "knight": 3,
+    "pawn": 1
+}
+
+# Piece-square terms in hundredths of a pawn, rows as seen by white which starts on row 0
+_CENTER = [
+    [-20, -10, -10, -10, -10, -10, -10, -20],
+    [-10,   0,   0,   0,   0,   0,   0, -10],
+    [-10,   0,   5,  10,  10,   5,   0, -10],
+    [-10,   5,  10,  20,  20,  10,   5, -10],
+    [-10,   5,  10,  20,  20,  10,   5, -10],
+    [-10,   0,   5,  10,  10,   5,   0, -10],
+    [-10,   0,   0,   0,   0,   0,   0, -10],
+    [-20, -10, -10, -10, -10, -10, -10, -20]
+]
+_PIECE_SQUARE_ROWS = {
+    'king': [
+        [ 20,  30,  10,   0,   0,  10,  30,  20],
+        [ 20,  20,   0,   0,   0,   0,  20,  20],
+        [-10, -20, -20, -20, -20, -20, -20, -10],
+        [-20, -30, -30, -40, -40, -30, -30, -20],
+        [-30, -40, -40, -50, -50, -40, -40, -30],
+        [-30, -40, -40, -50, -50, -40, -40, -30],
+        [-30, -40, -40, -50, -50, -40, -40, -30],
+        [-30, -40, -40, -50, -50, -40, -40, -30]
+    ],
+    'queen': _CENTER,
+    'rook': [[0] * 8 for _ in range(6)] + [[5, 10, 10, 10, 10, 10, 10, 5], [0] * 8],
+    'bishop': _CENTER,
+    'knight': [[2 * value for value in row] for row in _CENTER],
+    'pawn': [
+        [  0,   0,   0,   0,   0,   0,   0,   0],
+        [  5,  10,  10, -20, -20,  10,  10,   5],
+        [  5,  -5, -10,   0,   0, -10,  -5,   5],
+        [  0,   0,   0,  20,  20,   0,   0,   0],
+        [  5,   5,  10,  25,  25,  10,   5,   5],
+        [ 10,  10,  20,  30,  30,  20,  10,  10],
+        [ 50,  50,  50,  50,  50,  50,  50,  50],
+        [  0,   0,   0,   0,   0,   0,   0,   0]
+    ]
+}
+# Flattened per square, black reads the rows mirrored
+PIECE_SQUARE_TABLES = {
+    (color, name): [rows[x if color == 'w' else 7 - x][y] for x in range(8) for y in range(8)]
+    for color in ['b', 'w'] for name, rows in _PIECE_SQUARE_ROWS.items()
+}
+
+MOBILITY_WEIGHT = 0.1
+
+# Piece types of packed moves, ordered by value so the captures of bigger pieces sort first
+PIECE_TYPES = {'pawn': 1, 'knight': 2, 'bishop': 3, 'rook': 4, 'queen': 5, 'king': 6}
+TYPE_PIECES = {piece_type: name for name, piece_type in PIECE_TYPES.items()}
+
+# 4-bit cell codes of Board.to_bytes, the piece type with bit 3 set for black
+NIBBLE_LETTERS = ['.'] * 16
+for _name, _piece_type in PIECE_TYPES.items():
+    NIBBLE_LETTERS[_piece_type] = PIECE_LETTERS[_name].upper()
+    NIBBLE_LETTERS[_piece_type | 8] = PIECE_LETTERS[_name]
+POSITION_BYTES = 33
+
+def pack_move(start_sq: int, end_sq: int, name: AnyStr, captured_name: Optional[AnyStr], score: float) -> int:
+    """
+    Packs a move in a single int
+        bits  0-5   end cell
+        bits  6-11  start cell
+        bits 12-14  type of the moving piece
+        bits 15-17  type of the captured piece, 0 for quiet moves
+        bits 18-    ordering score
+    The low 12 bits are the move_key, and sorting packed moves in reverse orders them by score.
+    """
+    captured_type = PIECE_TYPES[captured_name] if captured_name else 0
+    return int(score) << 18 | captured_type << 15 | PIECE_TYPES[name] << 12 | start_sq << 6 | end_sq
+
+# Per piece name the (capture, quiet) packed move of a piece on cell 0 moving to cell 0,
+# move generation only ors in the cells and the captured type
+MOVE_CODES = {
+    name: (int(capture_score) << 18 | PIECE_TYPES[name] << 12, int(quiet_score) << 18 | PIECE_TYPES[name] << 12)
+    for name, (capture_score, quiet_score) in MOVE_SCORES.items()
+}
+
+# Reusable move lists of the search, one per ply so generating moves allocates no new list
+MAX_PLY = 128
+MOVE_BUFFERS: List[List[int]] = [[] for _ in range(MAX_PLY)]
+
+# Zobrist keys, one random 64-bit number per (color, piece name, square) and one for black to move
+_zobrist_rng = random.Random(0x5EED)
+ZOBRIST_KEYS = {(color, name): [_zobrist_rng.getrandbits(64) for _ in range(64)] for color in ['b', 'w'] for name in PIECE_VALUES}
+ZOBRIST_BLACK_TO_MOVE = _zobrist_rng.getrandbits(64)
+
+def move_key(move: Move) -> int:
+    # 12-bit (start, end) encoding, enough to identify a move of this ruleset
+    return _square(move.start_pos) << 6 | _square(move.end_pos)
+
+def find_move(board: Board, key: int) -> Optional[Move]:
+    # Builds the Move of a move_key or packed move on the board, a bare key scores 0
+    piece = board.piece_at(SQUARE_POSITIONS[key >> 6 & 63])
+    if not key or not piece:
+        return None
+
+    end_pos = SQUARE_POSITIONS[key & 63]
+    captured_piece = board.piece_at(end_pos)
+    return piece.move_factory(piece=piece, start_pos=piece.pos, end_pos=end_pos, score=float(key >> 18), is_capture=captured_piece is not None, captured_piece=captured_piece)
+
+class BitBoard(Board):
+    """
+    A Board backend keeping a 64-bit occupancy bitboard for every (color, piece name) pair
+    and a square -> piece mailbox, so piece lookups are an index and move generation,
+    capture detection and scoring are bit operations instead of scans over self.pieces.
+    """
+    def __init__(self, placement: Optional[str] = None):
+        super().__init__(placement)
+
+        self.mailbox: List[Optional[Piece]] = [None] * 64
+        self.bitboards = {(color, name): 0 for color in ['b', 'w'] for name in PIECE_VALUES}
+        self.occupancy = {'b': 0, 'w': 0}
+
+        for piece in self.pieces:
+            self._set(piece, _square(piece.pos))
+
+        # Cells attacked by the piece on every cell. Mutations only record the cells they emptied or
+        # filled, the next attack map query recomputes the sliders whose attacks reach one of them.
+        self.attack_sets: List[int] = [0] * 64
+        self.attack_maps = {'b': None, 'w': None}
+        self.changed_cells: int = -1
+        for piece in self.pieces:
+            self._place_attacks(piece, _square(piece.pos))
+
+    def _set(self, piece: Piece, sq: int):
+        bit = 1 << sq
+        self.mailbox[sq] = piece
+        self.bitboards[piece.color, piece.name] |= bit
+        self.occupancy[piece.color] |= bit
+
+    def _unset(self, piece: Piece, sq: int):
+        bit = ~(1 << sq)
+        self.mailbox[sq] = None
+        self.bitboards[piece.color, piece.name] &= bit
+        self.occupancy[piece.color] &= bit
+
+    def piece_at(self, pos: Position) -> Optional[Piece]:
+        return self.mailbox[_square(pos)]
+
+    def remove_piece(self, piece: Piece):
+        sq = _square(piece.pos)
+        self._unset(piece, sq)
+        super().remove_piece(piece)
+
+        self.attack_sets[sq] = 0
+        self.changed_cells |= 1 << sq
+        self.attack_maps['b'] = self.attack_maps['w'] = None
+
+    def restore_piece(self, piece: Piece, index: int):
+        super().restore_piece(piece, index)
+        sq = _square(piece.pos)
+        self._set(piece, sq)
+
+        self._place_attacks(piece, sq)
+        self.changed_cells |= 1 << sq
+        self.attack_maps['b'] = self.attack_maps['w'] = None
+
+    def relocate_piece(self, piece: Piece, end_pos: Position):
+        start_sq, end_sq = _square(piece.pos), _square(end_pos)
+        self._unset(piece, start_sq)
+        super().relocate_piece(piece, end_pos)
+        self._set(piece, end_sq)
+
+        self.attack_sets[start_sq] = 0
+        self._place_attacks(piece, end_sq)
+        self.changed_cells |= 1 << start_sq | 1 << end_sq
+        self.attack_maps['b'] = self.attack_maps['w'] = None
+
+    def _place_attacks(self, piece: Piece, sq: int):
+        match piece.name:
+            case "king":
+                self.attack_sets[sq] = KING_MASKS[sq]
+            case "knight":
+                self.attack_sets[sq] = KNIGHT_MASKS[sq]
+            case "pawn":
+                self.attack_sets[sq] = PAWN_CAPTURE_MASKS[piece.color][sq]
+            case _:
+                # A slider depends on the occupancy, all bits set makes the next refresh compute it
+                self.attack_sets[sq] = -1
+
+    def _refresh_attacks(self):
+        # A slider whose attacks reach no changed cell attacks exactly the same cells as before
+        changed = self.changed_cells
+        if not changed:
+            return
+        self.changed_cells = 0
+
+        occupied = self.occupancy['w'] | self.occupancy['b']
+        bitboards = self.bitboards
+        sliders = (bitboards['w', 'queen'] | bitboards['w', 'rook'] | bitboards['w', 'bishop']
+                   | bitboards['b', 'queen'] | bitboards['b', 'rook'] | bitboards['b', 'bishop'])
+
+        attack_sets = self.attack_sets
+        while sliders:
+            bit = sliders & -sliders
+            sliders ^= bit
+
+            sq = bit.bit_length() - 1
+            if attack_sets[sq] & changed:
+                piece = self.mailbox[sq]
+                attack_sets[sq] = self._attacks(piece.name, piece.color, sq, occupied)
+
+    def attacked_squares(self, color: AnyStr) -> int:
+        attacked = self.attack_maps[color]
+        if attacked is None:
+            self._refresh_attacks()
+            attacked = 0
+            pieces = self.occupancy[color]
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                attacked |= self.attack_sets[bit.bit_length() - 1]
+            self.attack_maps[color] = attacked
+
+        return attacked
+
+    def attackers(self, sq: int, color: AnyStr, occupied: int) -> int:
+        # Bitboard of the pieces of color attacking the cell, sliders are blocked by occupied
+        bitboards = self.bitboards
+        attackers = KNIGHT_MASKS[sq] & bitboards[color, 'knight']
+        attackers |= KING_MASKS[sq] & bitboards[color, 'king']
+        attackers |= PAWN_CAPTURE_MASKS['b' if color == 'w' else 'w'][sq] & bitboards[color, 'pawn']
+
+        queens = bitboards[color, 'queen']
+        rooks, bishops = bitboards[color, 'rook'] | queens, bitboards[color, 'bishop'] | queens
+        if rooks:
+            attackers |= self._attacks('rook', color, sq, occupied) & rooks
+        if bishops:
+            attackers |= self._attacks('bishop', color, sq, occupied) & bishops
+
+        return attackers
+
+    def find_king(self, player: AnyStr) -> Optional[Piece]:
+        kings = self.bitboards[player, 'king']
+
+        return self.mailbox[kings.bit_length() - 1] if kings else None
+
+    def is_attacked(self, pos: Position, color: AnyStr) -> bool:
+        return bool(self.attackers(_square(pos), color, self.occupancy['w'] | self.occupancy['b']))
+
+    def in_check(self, player: AnyStr) -> bool:
+        kings = self.bitboards[player, 'king']
+        if not kings:
+            return False
+
+        opponent = 'b' if player == 'w' else 'w'
+        return bool(self.attacked_squares(opponent) & kings)
+
+    def pins(self, player: AnyStr, king_sq: int) -> dict:
+        """
+        Pieces of the player pinned to their king, as cell -> the cells they may still move to,
+        which are the ray between the king and the pinning slider including the slider.
+        """
+        opponent = 'b' if player == 'w' else 'w'
+        own = self.occupancy[player]
+        occupied = own | self.occupancy[opponent]
+
+        queens = self.bitboards[opponent, 'queen']
+        rooks, bishops = self.bitboards[opponent, 'rook'] | queens, self.bitboards[opponent, 'bishop'] | queens
+
+        pins = {}
+        for direction in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+            ray = RAY_MASKS[direction][king_sq]
+            # No slider able to pin along the ray
+            if not ray & (rooks if direction in ROOK_DIRECTIONS else bishops):
+                continue
+
+            blockers = ray & occupied
+
+            first = _nearest(direction, blockers)
+            behind = blockers & RAY_MASKS[direction][first]
+            if not (own >> first & 1) or not behind:
+                continue
+
+            second = _nearest(direction, behind)
+            if (rooks if direction in ROOK_DIRECTIONS else bishops) >> second & 1:
+                pins[first] = ray ^ RAY_MASKS[direction][second]
+
+        return pins
+
+    def _generate_legal(self, player: AnyStr, moves: List[int], mask: int) -> List[int]:
+        # Legal moves from the checkers of the king and the pinned pieces, nothing is played to test them
+        moves.clear()
+        kings = self.bitboards[player, 'king']
+        if not kings:
+            # Without a king every move is legal
+            for name in PIECE_TYPES:
+                pieces = self.bitboards[player, name]
+                while pieces:
+                    bit = pieces & -pieces
+                    pieces ^= bit
+                    self._append_moves(name, player, bit.bit_length() - 1, moves, mask)
+            return moves
+
+        opponent = 'b' if player == 'w' else 'w'
+        king_sq = kings.bit_length() - 1
+        occupied = self.occupancy['w'] | self.occupancy['b']
+        checkers = self.attackers(king_sq, opponent, occupied)
+
+        # The king may not step onto an attacked cell, nor back along the ray of a checking slider
+        king_targets = KING_MASKS[king_sq] & ~self.occupancy[player] & mask
+        if king_targets:
+            king_targets &= ~self.attacked_squares(opponent)
+        if checkers & ~(self.bitboards[opponent, 'knight'] | self.bitboards[opponent, 'pawn']):
+            without_king = occupied ^ kings
+            targets = king_targets
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                if self.attackers(bit.bit_length() - 1, opponent, without_king):
+                    king_targets ^= bit
+        self._append_moves('king', player, king_sq, moves, king_targets)
+
+        if checkers & (checkers - 1):
+            # Double check, only the king can move
+            return moves
+
+        if checkers:
+            # Single check, capture the checker or block its ray
+            mask &= checkers | BETWEEN_MASKS[king_sq][checkers.bit_length() - 1]
+
+        pins = self.pins(player, king_sq)
+        for name in PIECE_TYPES:
+            if name == 'king':
+                continue
+
+            pieces = self.bitboards[player, name]
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                sq = bit.bit_length() - 1
+                self._append_moves(name, player, sq, moves, mask & pins[sq] if sq in pins else mask)
+
+        return moves
+
+    def generate_legal_moves(self, player: AnyStr, moves: List[int]) -> List[int]:
+        return self._generate_legal(player, moves, -1)
+
+    def generate_legal_captures(self, player: AnyStr, moves: List[int]) -> List[int]:
+        return self._generate_legal(player, moves, self.occupancy['b' if player == 'w' else 'w'])
+
+    def attacks(self, piece: Piece) -> int:
+        return self._attacks(piece.name, piece.color, _square(piece.pos), self.occupancy['w'] | self.occupancy['b'])
+
+    def targets(self, piece: Piece) -> int:
+        return self._targets(piece.name, piece.color, _square(piece.pos))
+
+    def _attacks(self, name: AnyStr, color: AnyStr, sq: int, occupied: int) -> int:
+        match name:
+            case "king":
+                return KING_MASKS[sq]
+            case "knight":
+                return KNIGHT_MASKS[sq]
+            case "pawn":
+                return PAWN_CAPTURE_MASKS[color][sq]
+
+        attacks = 0
+        for direction in SLIDER_DIRECTIONS[name]:
+            ray = RAY_MASKS[direction][sq]
+            blockers = ray & occupied
+            if blockers:
+                if direction[0] * 8 + direction[1] > 0:
+                    first = (blockers & -blockers).bit_length() - 1
+                else:
+                    first = blockers.bit_length() - 1
+                # Cut the ray behind the first blocker, the blocker itself stays attacked
+                ray ^= RAY_MASKS[direction][first]
+            attacks |= ray
+
+        return attacks
+
+    def _targets(self, name: AnyStr, color: AnyStr, sq: int) -> int:
+        own = self.occupancy[color]
+        enemy = self.occupancy['b' if color == 'w' else 'w']
+
+        if name != "pawn":
+            return self._attacks(name, color, sq, own | enemy) & ~own
+
+        # Pawns capture diagonally and push forward into empty cells only
+        empty = ~(own | enemy)
+        targets = PAWN_CAPTURE_MASKS[color][sq] & enemy
+
+        x = sq >> 3
+        pawn_dir, home_row = (1, 1) if color == 'w' else (-1, 6)
+        if 0 <= x + pawn_dir < 8:
+            push = 1 << (sq + 8*pawn_dir)
+            if push & empty:
+                targets |= push
+                if x == home_row:
+                    targets |= (1 << (sq + 16*pawn_dir)) & empty
+
+        return targets
+
+    def _append_moves(self, name: AnyStr, color: AnyStr, sq: int, moves: List[int], mask: int = -1):
+        capture_code, quiet_code = MOVE_CODES[name]
+        capture_code |= sq << 6
+        quiet_code |= sq << 6
+
+        mailbox = self.mailbox
+        targets = self._targets(name, color, sq) & mask
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+
+            end_sq = bit.bit_length() - 1
+            captured_piece = mailbox[end_sq]
+            if captured_piece:
+                moves.append(capture_code | PIECE_TYPES[captured_piece.name] << 15 | end_sq)
+            else:
+                moves.append(quiet_code | end_sq)
+
+    def generate_moves(self, player: AnyStr, moves: List[int]) -> List[int]:
+        moves.clear()
+        for name in PIECE_TYPES:
+            pieces = self.bitboards[player, name]
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                self._append_moves(name, player, bit.bit_length() - 1, moves)
+
+        return moves
+
+    def generate_captures(self, player: AnyStr, moves: List[int]) -> List[int]:
+        moves.clear()
+        enemy = self.occupancy['b' if player == 'w' else 'w']
+        for name in PIECE_TYPES:
+            pieces = self.bitboards[player, name]
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                self._append_moves(name, player, bit.bit_length() - 1, moves, enemy)
+
+        return moves
+
+    def piece_moves(self, piece: Piece) -> List[Move]:
+        codes = []
+        self._append_moves(piece.name, piece.color, _square(piece.pos), codes)
+        piece.available_moves = [find_move(self, code) for code in codes]
+
+        return piece.available_moves
+
+    def count_pieces(self, team: str):
+        return self.occupancy[team].bit_count()
+
+    def mobility(self, player: AnyStr) -> int:
+        return sum(self.targets(piece).bit_count() for piece in self.get_pieces_for_player(player))
+
+BOARD_BACKENDS = {'list': Board, 'bitboard': BitBoard}
+
+def new_board(backend: str = 'list', placement: Optional[str] = None) -> Board:
+    assert backend in BOARD_BACKENDS, f"Valid backends are {list(BOARD_BACKENDS)}, you provided {backend}"
+
+    return BOARD_BACKENDS[backend](placement)
+
 def check_minimax():
     for i in range(1):
         curr_player = next(PLAYERS)
@@ -491,68 +1184,584 @@ def check_queen_movement(board, piece):
 
     board.show()
 
-def minimax(board, depth, is_maximizing_player, a, b):
+def perft(board, depth, player, legal=True):
     if depth == 0 or board.game_over:
-        player = 'w' if is_maximizing_player else 'b'
-        return board.score_board(player), None, None
+        return 1
 
-    if is_maximizing_player:
-        max_score = -float('inf')
-        best_piece = None
-        best_move = None
-        for piece in board.get_pieces_for_player('w'):
-            moves = piece.calculate_moves(board)
-            sorted_moves = sorted(moves, key=lambda x: x.score, reverse=True)
-            for move in sorted_moves:
-                new_board = board.clone()
-                new_piece = piece.find_by_pos(piece.pos, new_board)
-                new_piece.move(new_board, move)
-                score, _, _ = minimax(new_board, depth - 1, False, a, b)
-                if score > max_score:
-                    max_score = score
-                    best_piece = piece
-                    best_move = move
-
-                if max_score >= b:
+    nodes = 0
+    opponent = 'b' if player == 'w' else 'w'
+    if legal:
+        moves = board.generate_legal_moves(player, MOVE_BUFFERS[depth])
+    else:
+        moves = board.generate_moves(player, MOVE_BUFFERS[depth])
+    for code in moves:
+        undo = board.make_packed(code)
+        nodes += perft(board, depth - 1, opponent, legal)
+        board.unmake_move(undo)
+
+    return nodes
+
+def check_backends(depth=3):
+    # Walks the game tree on both backends at once, every node must have the same move set
+    def walk(boards, depth, player):
+        if depth == 0 or boards[0].game_over:
+            return 1
+
+        move_sets = []
+        for board in boards:
+            move_sets.append({
+                (move.start_pos, move.end_pos, move.is_capture)
+                for piece in board.get_pieces_for_player(player) for move in board.piece_moves(piece)
+            })
+        assert move_sets[0] == move_sets[1], f"Backends differ for player {player}: {move_sets[0] ^ move_sets[1]}"
+        assert sorted(boards[0].generate_moves(player, [])) == sorted(boards[1].generate_moves(player, [])), f"Packed moves differ for player {player}"
+        # Filtering by playing every move and generating from checkers and pins must agree
+        assert sorted(boards[0].generate_legal_moves(player, [])) == sorted(boards[1].generate_legal_moves(player, [])), f"Legal moves differ for player {player}"
+        assert boards[1].attacked_squares(player) == boards[0].attacked_squares(player), f"Attack maps differ for player {player}"
+
+        nodes = 0
+        for start_pos, end_pos, _ in sorted(move_sets[0]):
+            undos = [board.make_move(next(m for m in board.piece_moves(board.piece_at(start_pos)) if m.end_pos == end_pos)) for board in boards]
+            nodes += walk(boards, depth - 1, 'b' if player == 'w' else 'w')
+            for board, undo in zip(boards, undos):
+                board.unmake_move(undo)
+
+        return nodes
+
+    nodes = walk([Board(), BitBoard()], depth, 'w')
+    print(f"perft({depth}) = {nodes} on both backends")
+
+class SearchTimeout(Exception):
+    pass
+
+class SearchClock:
+    def __init__(self, time_limit_ms: Optional[float] = None):
+        self.start: float = time.perf_counter()
+        self.deadline: Optional[float] = None if time_limit_ms is None else self.start + time_limit_ms / 1000
+        self.nodes: int = 0
+        self.qnodes: int = 0
+        self.cutoffs: int = 0
+
+    def tick(self):
+        self.nodes += 1
+        # Reading the clock is not free, it is only checked every 64 nodes
+        if self.deadline is not None and self.nodes & 63 == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+# Captures that cannot bring the score back within this many pawns of the bound are not searched
+DELTA_MARGIN = 2
+
+# Score of a checkmate, the remaining depth is added so the quickest mate scores highest
+MATE_SCORE = 100 * PIECE_VALUES["king"]
+
+class MoveOrdering:
+    def __init__(self, heuristics: bool = True):
+        """
+        Orders the moves of a search node: the transposition table move first, then captures
+        by most valuable victim / least valuable attacker, then the two killer moves of the ply,
+        then quiet moves by their history score. Killers and history persist between the
+        searches of one game, so iterative deepening reuses them.
+        With heuristics off moves are ordered by the hard-coded score of pack_move.
+        """
+        self.heuristics: bool = heuristics
+        self.killers: List[List[int]] = [[0, 0] for _ in range(MAX_PLY)]
+        self.history = {'b': [0] * 4096, 'w': [0] * 4096}
+
+    def order(self, moves: List[int], ply: int, player: AnyStr, tt_move: int):
+        if not self.heuristics:
+            moves.sort(reverse=True)
+        else:
+            killer_1, killer_2 = self.killers[ply]
+            history = self.history[player]
+
+            def rank(code):
+                key = code & 0xFFF
+                captured_type = code >> 15 & 7
+                if captured_type:
+                    return 1 << 34 | captured_type << 3 | 7 - (code >> 12 & 7)
+                if key == killer_1:
+                    return 1 << 33
+                if key == killer_2:
+                    return 1 << 32
+                return history[key]
+
+            moves.sort(key=rank, reverse=True)
+
+        if tt_move:
+            # The best move of an earlier search of this position is tried first
+            for idx, code in enumerate(moves):
+                if code & 0xFFF == tt_move:
+                    moves.insert(0, moves.pop(idx))
                     break
 
-                a = max(a, max_score)
-                if max_score >= b:
-                    break
-            if max_score >= b:
+    def cutoff(self, code: int, ply: int, player: AnyStr, depth: int):
+        # Only quiet moves are remembered, captures are already ordered first
+        if not self.heuristics or code >> 15 & 7:
+            return
+
+        key = code & 0xFFF
+        killers = self.killers[ply]
+        if killers[0] != key:
+            killers[1] = killers[0]
+            killers[0] = key
+
+        history = self.history[player]
+        history[key] += depth * depth
+        if history[key] >= 1 << 31:
+            # Keep history below the killer ranks
+            self.history[player] = [value // 2 for value in history]
+
+def minimax(board, depth, is_maximizing_player, a, b, tt: Optional[TranspositionTable] = None, clock: Optional[SearchClock] = None,
+            ordering: Optional[MoveOrdering] = None, quiescence: bool = True, stats: Optional[SearchStats] = None):
+    if ordering is None:
+        ordering = MoveOrdering()
+    score, code = _minimax(board, depth, 0, is_maximizing_player, a, b, tt, clock, ordering, quiescence, stats)
+
+    # Only the chosen move is turned into a Move, the search itself works on packed moves
+    best_move = find_move(board, code)
+    return score, best_move.piece if best_move else None, best_move
+
+def _quiesce(board, ply, is_maximizing_player, a, b, clock, stats) -> float:
+    """
+    Searches captures only until the position is quiet, so leaves are not scored in the middle of an exchange.
+    """
+    if clock is not None:
+        clock.tick()
+        clock.qnodes += 1
+
+    # Standing pat, the side to move does not have to capture
+    if stats is not None:
+        stats.qnodes += 1
+        stats.evaluations += 1
+        start_time = time.perf_counter()
+    stand_pat = board.score_board('w')
+    if stats is not None:
+        stats.timed('evaluate', start_time)
+    if board.game_over or ply >= MAX_PLY - 1:
+        return stand_pat
+
+    if is_maximizing_player:
+        if stand_pat >= b:
+            return stand_pat
+        a = max(a, stand_pat)
+    else:
+        if stand_pat <= a:
+            return stand_pat
+        b = min(b, stand_pat)
+
+    if stats is not None:
+        stats.movegen_calls += 1
+        start_time = time.perf_counter()
+    moves = board.generate_legal_captures('w' if is_maximizing_player else 'b', MOVE_BUFFERS[ply])
+    if stats is not None:
+        stats.timed('movegen', start_time)
+        start_time = time.perf_counter()
+    # Most valuable victim, then least valuable attacker
+    moves.sort(key=lambda code: (code >> 15 & 7) << 3 | 7 - (code >> 12 & 7), reverse=True)
+    if stats is not None:
+        stats.timed('ordering', start_time)
+
+    best_score = stand_pat
+    for code in moves:
+        gain = PIECE_VALUES[TYPE_PIECES[code >> 15 & 7]] + DELTA_MARGIN
+        # Delta pruning
+        if (stand_pat + gain <= a) if is_maximizing_player else (stand_pat - gain >= b):
+            continue
+
+        if stats is not None:
+            start_time = time.perf_counter()
+        undo = board.make_packed(code)
+        if stats is not None:
+            stats.timed('make', start_time)
+        try:
+            score = _quiesce(board, ply + 1, not is_maximizing_player, a, b, clock, stats)
+        finally:
+            board.unmake_move(undo)
+
+        if is_maximizing_player:
+            if score > best_score:
+                best_score = score
+            a = max(a, best_score)
+            if best_score >= b:
+                break
+        else:
+            if score < best_score:
+                best_score = score
+            b = min(b, best_score)
+            if best_score <= a:
                 break
 
-        return (max_score, best_piece, best_move)
+    return best_score
+
+def _minimax(board, depth, ply, is_maximizing_player, a, b, tt, clock, ordering, quiescence, stats) -> Tuple[float, int]:
+    if depth == 0 and quiescence and not board.game_over:
+        return _quiesce(board, ply, is_maximizing_player, a, b, clock, stats), 0
+
+    if clock is not None:
+        clock.tick()
+    if stats is not None:
+        stats.node(ply)
+
+    if depth == 0 or board.game_over:
+        # White maximizes, so leaves are always scored from white's side
+        if stats is not None:
+            stats.evaluations += 1
+            start_time = time.perf_counter()
+            score = board.score_board('w')
+            stats.timed('evaluate', start_time)
+            return score, 0
+        return board.score_board('w'), 0
+
+    key = board.zobrist if is_maximizing_player else board.zobrist ^ ZOBRIST_BLACK_TO_MOVE
+    a_orig, b_orig = a, b
+    tt_move = 0
+    if tt is not None:
+        if stats is not None:
+            start_time = time.perf_counter()
+        entry = tt.probe(key)
+        if stats is not None:
+            stats.timed('tt', start_time)
+        if entry:
+            tt_depth, tt_score, tt_bound, tt_move = entry
+            if tt_depth >= depth and tt_move and (
+                tt_bound == EXACT
+                or (tt_bound == LOWER_BOUND and tt_score >= b)
+                or (tt_bound == UPPER_BOUND and tt_score <= a)
+            ):
+                return tt_score, tt_move
+
+    player = 'w' if is_maximizing_player else 'b'
+    if stats is not None:
+        stats.movegen_calls += 1
+        start_time = time.perf_counter()
+    moves = board.generate_legal_moves(player, MOVE_BUFFERS[ply])
+    if stats is not None:
+        stats.timed('movegen', start_time)
+    if not moves:
+        # Checkmate or stalemate, the king is never actually captured
+        if board.in_check(player):
+            return (-(MATE_SCORE + depth) if is_maximizing_player else MATE_SCORE + depth), 0
+        return 0.0, 0
+
+    if stats is not None:
+        start_time = time.perf_counter()
+    ordering.order(moves, ply, player, tt_move)
+    if stats is not None:
+        stats.timed('ordering', start_time)
+
+    best_code = 0
+    if is_maximizing_player:
+        best_score = -float('inf')
+        for move_idx, code in enumerate(moves):
+            if stats is not None:
+                start_time = time.perf_counter()
+            undo = board.make_packed(code)
+            if stats is not None:
+                stats.timed('make', start_time)
+            try:
+                score, _ = _minimax(board, depth - 1, ply + 1, False, a, b, tt, clock, ordering, quiescence, stats)
+            finally:
+                # Also restores the board when the search runs out of time
+                board.unmake_move(undo)
+            if score > best_score:
+                best_score = score
+                best_code = code
+
+            a = max(a, best_score)
+            if best_score >= b:
+                if clock is not None:
+                    clock.cutoffs += 1
+                if stats is not None:
+                    stats.cutoff(move_idx)
+                ordering.cutoff(code, ply, player, depth)
+                break
     else:
-        min_score = float('inf')
-        best_piece = None
-        best_move = None
-        for piece in board.get_pieces_for_player('b'):
-            moves = piece.calculate_moves(board)
-            sorted_moves = sorted(moves, key=lambda x: x.score, reverse=True)
-            for move in sorted_moves:
-                new_board = board.clone()
-                new_piece = piece.find_by_pos(piece.pos, new_board)
-                new_piece.move(new_board, move)
-                score, _, _ = minimax(new_board, depth - 1, True, a, b)
-                if score < min_score:
-                    min_score = score
-                    best_piece = piece
-                    best_move = move
-
-                b = min(b, min_score)
-                if min_score <= a:
-                    break
-            if min_score <= a:
+        best_score = float('inf')
+        for move_idx, code in enumerate(moves):
+            if stats is not None:
+                start_time = time.perf_counter()
+            undo = board.make_packed(code)
+            if stats is not None:
+                stats.timed('make', start_time)
+            try:
+                score, _ = _minimax(board, depth - 1, ply + 1, True, a, b, tt, clock, ordering, quiescence, stats)
+            finally:
+                # Also restores the board when the search runs out of time
+                board.unmake_move(undo)
+            if score < best_score:
+                best_score = score
+                best_code = code
+
+            b = min(b, best_score)
+            if best_score <= a:
+                if clock is not None:
+                    clock.cutoffs += 1
+                if stats is not None:
+                    stats.cutoff(move_idx)
+                ordering.cutoff(code, ply, player, depth)
                 break
 
+    if tt is not None and best_code:
+        if best_score <= a_orig:
+            bound = UPPER_BOUND
+        elif best_score >= b_orig:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        tt.store(key, depth, best_score, bound, best_code & 0xFFF)
+
+    return best_score, best_code
+
+@dataclass
+class SearchResult:
+    score: float
+    piece: Optional[Piece]
+    move: Optional[Move]
+    depth: int
+    nodes: int
+    time_ms: float
+    pv: List[Position] = field(default_factory=list)
+    cached: bool = False
+
+def principal_variation(board, tt: TranspositionTable, is_maximizing_player, depth):
+    pv = []
+    undos = []
+    for _ in range(depth):
+        key = board.zobrist if is_maximizing_player else board.zobrist ^ ZOBRIST_BLACK_TO_MOVE
+        entry = tt.probe(key)
+        move = find_move(board, entry[3]) if entry else None
+        if not move or move.piece.color != ('w' if is_maximizing_player else 'b'):
+            break
+
+        pv.append((move.start_pos, move.end_pos))
+        undos.append(board.make_move(move))
+        is_maximizing_player = not is_maximizing_player
+
+    for undo in reversed(undos):
+        board.unmake_move(undo)
+
+    return pv
+
+def search(board, time_limit_ms: float, max_depth: int, is_maximizing_player: bool = True, tt: Optional[TranspositionTable] = None,
+           ordering: Optional[MoveOrdering] = None, cache: Optional[PositionCache] = None, stats: Optional[SearchStats] = None) -> SearchResult:
+    """
+    Iterative deepening: searches depth 1, 2, ... max_depth until the time budget runs out
+    and returns the best move of the deepest completed iteration. The transposition table
+    carries the principal variation of each iteration over to order the next one.
+    Opening and endgame positions found in the position cache are not searched at all.
+    Stats are reset first, so they hold the counters of this move only.
+    """
+    if stats is not None:
+        stats.reset()
+    clock = SearchClock()
+    key = board.zobrist if is_maximizing_player else board.zobrist ^ ZOBRIST_BLACK_TO_MOVE
+    use_cache = cache is not None and cache.wants(len(board.move_history), len(board.pieces))
+    if use_cache:
+        entry = cache.probe(key)
+        if entry and entry[0] >= min(max_depth, cache.min_depth):
+            move = find_move(board, entry[2])
+            if move and move.piece.color == ('w' if is_maximizing_player else 'b'):
+                return SearchResult(entry[1], move.piece, move, entry[0], 0, clock.elapsed_ms(), cached=True)
+
+    if tt is None:
+        tt = TranspositionTable(size_mb=4)
+    tt.new_search()
+    if ordering is None:
+        ordering = MoveOrdering()
+    if stats is not None:
+        stats.start_profile()
+
+    # Depth 1 always runs to completion so there is a move to play
+    score, piece, move = minimax(board, 1, is_maximizing_player, -float('inf'), float('inf'), tt, clock, ordering, stats=stats)
+    result = SearchResult(score, piece, move, 1, clock.nodes, clock.elapsed_ms())
+
+    clock.deadline = clock.start + time_limit_ms / 1000
+    for depth in range(2, max_depth + 1):
+        # The next iteration costs several times the previous one, do not start what cannot finish
+        if clock.elapsed_ms() > time_limit_ms / 2:
+            break
+
+        try:
+            score, piece, move = minimax(board, depth, is_maximizing_player, -float('inf'), float('inf'), tt, clock, ordering, stats=stats)
+        except SearchTimeout:
+            break
+
+        result = SearchResult(score, piece, move, depth, clock.nodes, clock.elapsed_ms())
+
+    result.nodes = clock.nodes
+    result.time_ms = clock.elapsed_ms()
+    result.pv = principal_variation(board, tt, is_maximizing_player, result.depth)
+
+    if stats is not None:
+        stats.stop_profile(ply=len(board.move_history), fen=board.to_fen(), depth=result.depth, time_ms=result.time_ms,
+                           move=square_name(result.move.start_pos) + square_name(result.move.end_pos) if result.move else None)
+
+    if use_cache and result.move:
+        cache.store(key, result.depth, result.score, move_key(result.move))
+
+    return result
+
+# Shared best root score of the parallel search, set in every worker process by _init_search_worker
+_worker_bound = None
 
-        return (min_score, best_piece, best_move)
+def _init_search_worker(bound):
+    global _worker_bound
+    _worker_bound = bound
+
+def _search_root_move(backend: str, position: bytes, key: int, depth: int, is_maximizing_player: bool):
+    board = BOARD_BACKENDS[backend].from_bytes(position)
+    board.make_move(find_move(board, key))
+
+    # The best score any worker found so far is the bound of this root move
+    bound = _worker_bound.value
+    if is_maximizing_player:
+        a, b = bound, float('inf')
+    else:
+        a, b = -float('inf'), bound
+
+    score, _, _ = minimax(board, depth - 1, not is_maximizing_player, a, b)
+
+    # A score at or below alpha (at or above beta for black) only bounds the move and never raises the shared bound
+    with _worker_bound.get_lock():
+        if (score > _worker_bound.value) if is_maximizing_player else (score < _worker_bound.value):
+            _worker_bound.value = score
+
+    return key, score, bound
+
+class ParallelSearcher:
+    def __init__(self, workers: Optional[int] = None):
+        """
+        Splits the root moves of minimax across a pool of worker processes.
+        Workers receive the position in its 33-byte encoding and the root move as its
+        12-bit key, and share the best root score found so far as their alpha (beta for black).
+        Of the root moves with the best score the first in move order is played, whichever
+        worker finishes first, so the chosen move does not depend on scheduling.
+        """
+        self.workers: int = workers or os.cpu_count()
+        self.bound = multiprocessing.Value('d', 0.0)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_search_worker, initargs=(self.bound,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def search(self, board, depth, is_maximizing_player):
+        if depth <= 1 or board.game_over:
+            return minimax(board, depth, is_maximizing_player, -float('inf'), float('inf'))
+
+        player = 'w' if is_maximizing_player else 'b'
+        moves = [find_move(board, code) for code in board.generate_legal_moves(player, [])]
+        sorted_moves = sorted(moves, key=lambda x: x.score, reverse=True)
+        if not sorted_moves:
+            return minimax(board, depth, is_maximizing_player, -float('inf'), float('inf'))
+
+        # The first move is searched here with a full window, it gives the workers a bound to start from
+        best_move = sorted_moves[0]
+        undo = board.make_move(best_move)
+        best_score, _, _ = minimax(board, depth - 1, not is_maximizing_player, -float('inf'), float('inf'))
+        board.unmake_move(undo)
+        self.bound.value = best_score
+
+        backend = next(name for name, backend in BOARD_BACKENDS.items() if type(board) is backend)
+        position = board.to_bytes()
+        futures = {
+            self.executor.submit(_search_root_move, backend, position, move_key(move), depth, is_maximizing_player): idx
+            for idx, move in enumerate(sorted_moves[1:], 1)
+        }
+        # Exact scores and upper (lower for black) bounds of the root moves, by their index in sorted_moves
+        exact, bounded = {0: best_score}, {}
+        for future in as_completed(futures):
+            _, score, bound = future.result()
+            if (score > bound) if is_maximizing_player else (score < bound):
+                exact[futures[future]] = score
+            else:
+                bounded[futures[future]] = score
+
+        best_score = (max if is_maximizing_player else min)(exact.values())
+        best_idx = min(idx for idx, score in exact.items() if score == best_score)
+        # A move ahead of the best one that was bounded by the best score may tie with it,
+        # a search with a window just short of the best score tells
+        for idx in sorted(bounded):
+            if idx > best_idx:
+                break
+            if bounded[idx] != best_score:
+                continue
+            undo = board.make_move(sorted_moves[idx])
+            if is_maximizing_player:
+                a, b = math.nextafter(best_score, -float('inf')), float('inf')
+            else:
+                a, b = -float('inf'), math.nextafter(best_score, float('inf'))
+            score, _, _ = minimax(board, depth - 1, not is_maximizing_player, a, b)
+            board.unmake_move(undo)
+            if (score > a) if is_maximizing_player else (score < b):
+                best_idx = idx
+                break
+
+        best_move = sorted_moves[best_idx]
+        return best_score, best_move.piece, best_move
+
+# White to move in every position
+BENCHMARK_FENS = [
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBKQBNR w - - 0 1',
+    'rnbqkbnr/p1pp1pp1/8/1p2p2p/8/P7/1PPPPPPP/RNBKQBNR w - - 0 1',
+    'r1bqkb1r/p1ppppp1/1pn5/7p/N5n1/1P3P1N/P1PPP1PP/R1BKQB1R w - - 0 1',
+    'rnb2b2/pp1pkpp1/1q2p2r/P1p4p/1PB1n1P1/2P5/3P1P1P/RNBKQ1NR w - - 0 1',
+    'r1b1kb1r/pp2p3/n1pp3p/5pp1/PP4n1/2N1P2N/1BPPKPPR/RQ3B2 w - - 0 1'
+]
+
+def check_parallel_search(depth=4, workers=None, backend='bitboard'):
+    serial_total, parallel_total = 0.0, 0.0
+    with ParallelSearcher(workers) as searcher:
+        for fen in BENCHMARK_FENS:
+            board = BOARD_BACKENDS[backend].from_fen(fen)
+
+            start_time = time.perf_counter()
+            serial_score, _, _ = minimax(board, depth, True, -float('inf'), float('inf'))
+            serial_time = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            parallel_score, _, parallel_move = searcher.search(board, depth, True)
+            parallel_time = time.perf_counter() - start_time
+
+            assert serial_score == parallel_score, f"Parallel search scored {parallel_score}, serial minimax {serial_score}"
+            # Ties may be broken differently from the serial search, the chosen move has to reach the same score
+            undo = board.make_move(parallel_move)
+            move_score, _, _ = minimax(board, depth - 1, False, -float('inf'), float('inf'))
+            board.unmake_move(undo)
+            assert move_score == serial_score, f"Parallel search played {parallel_move}, which scores {move_score}, not {serial_score}"
+            # The same move every time, however the workers are scheduled
+            for _ in range(2):
+                _, _, repeat_move = searcher.search(board, depth, True)
+                assert move_key(repeat_move) == move_key(parallel_move), f"Parallel search played {parallel_move}, then {repeat_move}"
+            serial_total += serial_time
+            parallel_total += parallel_time
+            print(f"{fen} | serial {serial_time:.3f}s | parallel {parallel_time:.3f}s | speedup {serial_time / parallel_time:.2f}x")
+
+        print(f"{searcher.workers} workers, depth {depth} | serial {serial_total:.3f}s | parallel {parallel_total:.3f}s | speedup {serial_total / parallel_total:.2f}x")
 
 if __name__ == "__main__":
-    board = Board()
+    BACKEND = 'bitboard'
+
+    board = new_board(BACKEND)
 
     PLAYERS = itertools.cycle(['w', 'b'])
+    TT = TranspositionTable(size_mb=16)
+    ORDERING = MoveOrdering()
+    # Set a path, e.g. 'position_cache.bin', to keep searched openings and endgames between runs
+    CACHE_PATH = None
+    CACHE = PositionCache(CACHE_PATH) if CACHE_PATH else None
+    # Set a path to append a per-move profile trace
+    STATS = SearchStats(trace_path=None)
+    TIME_LIMIT_MS = 2000
+    MAX_DEPTH = 6
 
     white_pieces = [piece for piece in board.pieces if piece.color == 'w']
     black_pieces = [piece for piece in board.pieces if piece.color == 'b']
@@ -562,17 +1771,19 @@ if __name__ == "__main__":
     for _ in range(50):
         curr_player = next(PLAYERS)
 
-        alpha = -float('inf')
-        beta = float('inf')
-
-        start_time = time.time()
-        score, piece, move = minimax(board, 3, curr_player == 'w', a=alpha, b=beta)
-        end_time = time.time()
+        result = search(board, TIME_LIMIT_MS, MAX_DEPTH, curr_player == 'w', tt=TT, ordering=ORDERING, cache=CACHE, stats=STATS)
 
-        if piece:
-            piece.move(board, move)
+        if result.piece:
+            result.piece.move(board, result.move)
         else:
-            print(f"Player {curr_player} won!")
+            print(f"Player {curr_player} has no legal move, {board.status(curr_player)}")
             break
-        board.show(curr_player, score, end_time - start_time)
+        print(f"Depth {result.depth} | Nodes {result.nodes} | PV {result.pv}" + (" | cached" if result.cached else ""))
+        print(f"Search stats {STATS.summary()}")
+        board.show(curr_player, result.score, result.time_ms / 1000)
+
+    print(f"Transposition table {TT.stats()}")
+    if CACHE is not None:
+        print(f"Position cache {CACHE.stats()}")
+        CACHE.close()
 
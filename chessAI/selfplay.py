@@ -0,0 +1,229 @@
+"""
+Headless batch self-play for data generation. Games run independently across a process pool
+and every finished game is streamed as one compact record, to a JSONL or PGN file if asked.
+
+    python selfplay.py --games 100 --depth 3 --workers 8 --output games.jsonl
+    python selfplay.py --games 100 --time-ms 200 --output games.pgn --format pgn
+"""
+import os
+import json
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterator, Optional, Union, TextIO
+
+from main import new_board, search, square_name, find_move, move_key, MoveOrdering, PositionCache, BOARD_BACKENDS, \
+    SQUARE_POSITIONS, TYPE_PIECES
+from transposition import TranspositionTable
+
+RESULTS = {'w': '1-0', 'b': '0-1', None: '1/2-1/2'}
+PIECE_LETTERS = {'knight': 'N', 'bishop': 'B', 'rook': 'R', 'queen': 'Q', 'king': 'K'}
+
+
+def play_game(game_id: int, depth_or_time: Union[int, float], max_plies: int = 50, random_plies: int = 2, seed: int = 0,
+              backend: str = 'bitboard', tt_mb: float = 16, cache_path: Optional[str] = None, render: bool = False) -> dict:
+    """
+    Plays one self-play game and returns its record.
+
+    Parameters
+    ----------
+    game_id:        Index of the game, also offsets the seed of its random opening
+    depth_or_time:  An int searches every move to that fixed depth, a float is a time budget per move in ms
+    max_plies:      The game is a draw once this many plies are played
+    random_plies:   Number of random opening plies, so games of a batch differ
+    cache_path:     Position cache file shared by the games, see PositionCache
+    render:         Show the board after every move, off for throughput
+    """
+    if isinstance(depth_or_time, int):
+        time_limit_ms, max_depth = float('inf'), depth_or_time
+    else:
+        time_limit_ms, max_depth = depth_or_time, 64
+
+    rng = random.Random(seed + game_id)
+    board = new_board(backend)
+    tt = TranspositionTable(size_mb=tt_mb)
+    ordering = MoveOrdering()
+    cache = PositionCache(cache_path) if cache_path else None
+
+    record = {'game': game_id, 'seed': seed + game_id, 'moves': [], 'scores': [], 'times_ms': [], 'depths': [], 'nodes': [], 'cached': 0}
+    winner = None
+    player = 'w'
+    for ply in range(max_plies):
+        if ply < random_plies:
+            moves = [find_move(board, code) for code in board.generate_legal_moves(player, [])]
+            move = rng.choice(moves) if moves else None
+            score, depth, nodes, time_ms = None, 0, 0, 0.0
+        else:
+            result = search(board, time_limit_ms, max_depth, player == 'w', tt=tt, ordering=ordering, cache=cache)
+            move = result.move
+            record['cached'] += result.cached
+            score, depth, nodes, time_ms = result.score, result.depth, result.nodes, result.time_ms
+
+        if not move:
+            # No legal move left for the side to play, checkmate or stalemate
+            if board.in_check(player):
+                winner = 'b' if player == 'w' else 'w'
+            break
+
+        board.make_move(move)
+        record['moves'].append(square_name(move.start_pos) + square_name(move.end_pos))
+        record['scores'].append(None if score is None else round(score, 2))
+        record['times_ms'].append(round(time_ms, 2))
+        record['depths'].append(depth)
+        record['nodes'].append(nodes)
+
+        if render:
+            board.show(player, score, time_ms / 1000)
+
+        if board.game_over:
+            winner = player
+            break
+        player = 'b' if player == 'w' else 'w'
+
+    if cache:
+        cache.close()
+
+    record['plies'] = len(record['moves'])
+    record['result'] = RESULTS[winner]
+
+    return record
+
+
+def san(board, move, player: str) -> str:
+    """
+    The move of player in standard algebraic notation, on the board before it is played.
+    The ruleset has no castling, en passant or promotion, so neither has the notation.
+    """
+    end = square_name(move.end_pos)
+    if move.piece.name == 'pawn':
+        text = (square_name(move.start_pos)[0] + 'x' if move.is_capture else '') + end
+    else:
+        # Other pieces of the same kind reaching the cell are told apart by the file, else the rank, else both
+        end_sq = move_key(move) & 63
+        others = [square_name(SQUARE_POSITIONS[code >> 6 & 63]) for code in board.generate_legal_moves(player, [])
+                  if code & 63 == end_sq and TYPE_PIECES[code >> 12 & 7] == move.piece.name and code & 4095 != move_key(move)]
+        start = square_name(move.start_pos)
+        if not others:
+            origin = ''
+        elif all(other[0] != start[0] for other in others):
+            origin = start[0]
+        elif all(other[1] != start[1] for other in others):
+            origin = start[1]
+        else:
+            origin = start
+        text = PIECE_LETTERS[move.piece.name] + origin + ('x' if move.is_capture else '') + end
+
+    opponent = 'b' if player == 'w' else 'w'
+    undo = board.make_move(move)
+    if board.in_check(opponent):
+        text += '#' if board.status(opponent) == 'checkmate' else '+'
+    board.unmake_move(undo)
+
+    return text
+
+
+def to_pgn(record: dict) -> str:
+    # The game is replayed from the initial position to write its moves in SAN, the FEN tag gives that
+    # position since its kings and queens are swapped from the standard one
+    board = new_board()
+    headers = [
+        ('Event', 'chessAI self-play'),
+        ('Round', str(record['game'])),
+        ('White', 'chessAI'),
+        ('Black', 'chessAI'),
+        ('Result', record['result']),
+        ('SetUp', '1'),
+        ('FEN', board.to_fen()),
+        ('PlyCount', str(record['plies']))
+    ]
+    text = ''.join(f'[{name} "{value}"]\n' for name, value in headers)
+
+    moves = []
+    for ply, name in enumerate(record['moves']):
+        player = 'w' if ply % 2 == 0 else 'b'
+        # Cells are named as square_name names them, row from the rank and column from the file
+        start, end = ((int(name[idx + 1]) - 1) * 8 + 'abcdefgh'.index(name[idx]) for idx in (0, 2))
+        move = find_move(board, start << 6 | end)
+        moves.append(f"{ply // 2 + 1}. {san(board, move, player)}" if player == 'w' else san(board, move, player))
+        board.make_move(move)
+
+    return text + '\n' + ' '.join(moves + [record['result']]) + '\n\n'
+
+
+def write_record(record: dict, fp: TextIO, fmt: str = 'jsonl'):
+    if fmt == 'pgn':
+        fp.write(to_pgn(record))
+    else:
+        fp.write(json.dumps(record, separators=(',', ':')) + '\n')
+    fp.flush()
+
+
+def play_games(n: int, depth_or_time: Union[int, float], workers: Optional[int] = None, output: Optional[str] = None,
+               fmt: str = 'jsonl', **game_kwargs) -> Iterator[dict]:
+    """
+    Plays n independent games across a pool of worker processes and yields every game record
+    as soon as it finishes, in completion order. With an output path the records are also
+    appended to it as JSONL or PGN. It is a generator, games are played while it is consumed.
+    Keyword arguments are passed on to play_game.
+    """
+    assert fmt in ['jsonl', 'pgn'], f"Valid formats are 'jsonl' and 'pgn', you provided {fmt}"
+    workers = workers or os.cpu_count()
+
+    fp = open(output, 'a') if output else None
+    try:
+        if workers == 1:
+            for game_id in range(n):
+                record = play_game(game_id, depth_or_time, **game_kwargs)
+                if fp:
+                    write_record(record, fp, fmt)
+                yield record
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Keep a few games queued per worker instead of submitting all of them upfront
+            game_ids = iter(range(n))
+            pending = set()
+            while True:
+                for game_id in game_ids:
+                    pending.add(executor.submit(play_game, game_id, depth_or_time, **game_kwargs))
+                    if len(pending) >= 2 * workers:
+                        break
+
+                if not pending:
+                    break
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record = future.result()
+                    if fp:
+                        write_record(record, fp, fmt)
+                    yield record
+    finally:
+        if fp:
+            fp.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch self-play")
+    parser.add_argument('--games', type=int, default=10)
+    search_limit = parser.add_mutually_exclusive_group()
+    search_limit.add_argument('--depth', type=int, default=3, help="Fixed search depth per move")
+    search_limit.add_argument('--time-ms', type=float, default=None, help="Time budget per move")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-plies', type=int, default=50)
+    parser.add_argument('--random-plies', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', default='bitboard', choices=list(BOARD_BACKENDS))
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--cache', default=None, help="Position cache file shared by all games")
+    parser.add_argument('--format', default='jsonl', choices=['jsonl', 'pgn'])
+    parser.add_argument('--render', action='store_true')
+    args = parser.parse_args()
+
+    depth_or_time = args.time_ms if args.time_ms is not None else args.depth
+    records = play_games(args.games, depth_or_time, args.workers, args.output, args.format, max_plies=args.max_plies,
+                         random_plies=args.random_plies, seed=args.seed, backend=args.backend, cache_path=args.cache,
+                         render=args.render)
+    for record in records:
+        print(f"Game {record['game']} | {record['result']} in {record['plies']} plies | {sum(record['times_ms']):.0f} ms searching"
+              f" | {record['cached']} cached moves")
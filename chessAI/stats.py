@@ -0,0 +1,96 @@
+import json
+import time
+import pstats
+import cProfile
+from typing import Optional, Dict, List
+
+# Timed parts of a search node, make times make_move only, unmake mirrors it
+PHASES = ['tt', 'movegen', 'ordering', 'make', 'evaluate']
+
+
+class SearchStats:
+    def __init__(self, trace_path: Optional[str] = None, profile_top: int = 15):
+        """
+        Counters and phase timers of a search, filled in when passed to minimax or search.
+        The search only checks `stats is not None`, so leaving it out costs next to nothing.
+
+        Parameters
+        ----------
+        trace_path:     JSONL file every search() appends its stats and a cProfile summary to,
+                        one line per move. The profiler only runs when it is set
+        profile_top:    Functions of the cProfile summary, by internal time
+
+        Counters
+        --------
+        nodes_per_ply:      Main search nodes by distance from the root
+        qnodes:             Quiescence nodes
+        cutoffs:            Beta cutoffs of the main search
+        first_move_cutoffs: Cutoffs caused by the first move searched, a measure of move ordering
+        evaluations:        Calls of score_board
+        movegen_calls:      Calls of the (legal) move and capture generators
+        phase_time:         Seconds spent per phase, see PHASES
+        """
+        self.trace_path = trace_path
+        self.profile_top = profile_top
+        self.profiler: Optional[cProfile.Profile] = None
+        self.reset()
+
+    def reset(self):
+        self.nodes_per_ply: Dict[int, int] = {}
+        self.qnodes: int = 0
+        self.cutoffs: int = 0
+        self.first_move_cutoffs: int = 0
+        self.evaluations: int = 0
+        self.movegen_calls: int = 0
+        self.phase_time = {phase: 0.0 for phase in PHASES}
+
+    def node(self, ply: int):
+        self.nodes_per_ply[ply] = self.nodes_per_ply.get(ply, 0) + 1
+
+    def cutoff(self, move_idx: int):
+        self.cutoffs += 1
+        if move_idx == 0:
+            self.first_move_cutoffs += 1
+
+    def timed(self, phase: str, start_time: float):
+        self.phase_time[phase] += time.perf_counter() - start_time
+
+    def nodes(self) -> int:
+        return sum(self.nodes_per_ply.values())
+
+    def first_move_cutoff_rate(self) -> float:
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+    def summary(self) -> dict:
+        return {
+            'nodes': self.nodes(),
+            'nodes_per_ply': [self.nodes_per_ply[ply] for ply in sorted(self.nodes_per_ply)],
+            'quiescence_nodes': self.qnodes,
+            'cutoffs': self.cutoffs,
+            'first_move_cutoff_rate': self.first_move_cutoff_rate(),
+            'evaluations': self.evaluations,
+            'movegen_calls': self.movegen_calls,
+            'phase_ms': {phase: seconds * 1000 for phase, seconds in self.phase_time.items()}
+        }
+
+    def start_profile(self):
+        if self.trace_path:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop_profile(self, **move_info):
+        # Appends the stats of the search and its profile to the trace file, move_info describes the move
+        if self.profiler is None:
+            return
+        self.profiler.disable()
+
+        rows: List[dict] = []
+        profile = pstats.Stats(self.profiler).stats
+        for (filename, line, function), (_, ncalls, tottime, cumtime, _) in profile.items():
+            rows.append({'function': f"{filename}:{line}({function})", 'ncalls': ncalls,
+                         'tottime_ms': tottime * 1000, 'cumtime_ms': cumtime * 1000})
+        rows.sort(key=lambda row: row['tottime_ms'], reverse=True)
+        self.profiler = None
+
+        with open(self.trace_path, 'a') as fp:
+            fp.write(json.dumps({**move_info, **self.summary(), 'profile': rows[:self.profile_top]}) + '\n')
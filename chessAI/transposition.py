@@ -0,0 +1,100 @@
+from array import array
+from typing import Optional, Tuple
+
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+
+# key (8 bytes) + score (8) + best move (2) + depth, bound, generation (1 each)
+ENTRY_BYTES = 21
+
+Entry = Tuple[int, float, int, int]
+
+
+class TranspositionTable:
+    def __init__(self, size_mb: float = 16):
+        """
+        A fixed-size table of searched positions keyed by their Zobrist key.
+        Entries live in flat typed arrays, so the memory budget is honoured
+        exactly instead of growing a dict of Python objects.
+
+        Parameters
+        ----------
+        size_mb:    Memory budget of the table in megabytes
+
+        Replacement policy
+        ------------------
+        A slot is overwritten when it is empty, holds the same position,
+        was written during an older search or was searched to a depth
+        not greater than the new entry.
+        """
+        self.size: int = max(1, int(size_mb * 2**20) // ENTRY_BYTES)
+
+        self.keys = array('Q', bytes(8 * self.size))
+        self.scores = array('d', bytes(8 * self.size))
+        self.moves = array('H', bytes(2 * self.size))
+        self.depths = array('b', bytes(self.size))
+        self.bounds = array('B', bytes(self.size))
+        self.generations = array('B', bytes(self.size))
+        self.used = array('B', bytes(self.size))
+
+        self.generation: int = 0
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.collisions: int = 0
+        self.stores: int = 0
+        self.overwrites: int = 0
+
+    def new_search(self):
+        # Entries of previous searches are kept for move ordering but are replaced first
+        self.generation = (self.generation + 1) % 256
+
+    def probe(self, key: int) -> Optional[Entry]:
+        idx = key % self.size
+
+        if not self.used[idx]:
+            self.misses += 1
+            return None
+
+        if self.keys[idx] != key:
+            self.collisions += 1
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return self.depths[idx], self.scores[idx], self.bounds[idx], self.moves[idx]
+
+    def store(self, key: int, depth: int, score: float, bound: int, move: int):
+        idx = key % self.size
+
+        if self.used[idx] and self.keys[idx] != key:
+            if self.generations[idx] == self.generation and self.depths[idx] > depth:
+                return
+            self.overwrites += 1
+
+        self.keys[idx] = key
+        self.scores[idx] = score
+        self.moves[idx] = move
+        self.depths[idx] = depth
+        self.bounds[idx] = bound
+        self.generations[idx] = self.generation
+        self.used[idx] = 1
+
+        self.stores += 1
+
+    def clear(self):
+        self.used = array('B', bytes(self.size))
+        self.hits = self.misses = self.collisions = self.stores = self.overwrites = 0
+
+    def stats(self) -> dict:
+        probes = self.hits + self.misses
+        return {
+            'size': self.size,
+            'size_mb': self.size * ENTRY_BYTES / 2**20,
+            'filled': sum(self.used),
+            'hits': self.hits,
+            'misses': self.misses,
+            'collisions': self.collisions,
+            'stores': self.stores,
+            'overwrites': self.overwrites,
+            'hit_rate': self.hits / probes if probes else 0.0
+        }